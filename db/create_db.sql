@@ -1,6 +1,10 @@
 DROP VIEW IF EXISTS TagByGroup;
 DROP VIEW IF EXISTS HostHasTagView;
 
+DROP TABLE IF EXISTS HostVarIndex;
+DROP TABLE IF EXISTS ChangeLog;
+DROP TABLE IF EXISTS InventoryHost;
+DROP TABLE IF EXISTS InventoryTag;
 DROP TABLE IF EXISTS HostHasTag;
 DROP TABLE IF EXISTS Host;
 DROP TABLE IF EXISTS Tag;
@@ -33,6 +37,38 @@ CREATE TABLE HostHasTag (
 		REFERENCES Tag(TagID)
 );
 
+CREATE TABLE InventoryHost (
+	HostID INT NOT NULL PRIMARY KEY,
+	Hostname VARCHAR(255) NOT NULL,
+	Vars LONGTEXT NOT NULL,
+	INDEX (Hostname)
+);
+
+CREATE TABLE InventoryTag (
+	TagID INT NOT NULL PRIMARY KEY,
+	TagName VARCHAR(64) NOT NULL,
+	TagGroup VARCHAR(64),
+	Description TEXT,
+	Vars LONGTEXT NOT NULL,
+	Hosts LONGTEXT NOT NULL,
+	INDEX (TagGroup, TagName)
+);
+
+CREATE TABLE ChangeLog (
+	Seq BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+	ChangeTime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	ObjectType VARCHAR(8) NOT NULL,
+	ObjectID INT NOT NULL,
+	ObjectName VARCHAR(255) NOT NULL,
+	Action VARCHAR(32) NOT NULL,
+	Detail JSON NULL
+);
+
+CREATE TABLE HostVarIndex (
+	Path VARCHAR(255) NOT NULL PRIMARY KEY,
+	ColumnName VARCHAR(64) NOT NULL
+);
+
 CREATE TABLE Metadata (
 	KeyName VARCHAR(64) NOT NULL PRIMARY KEY,
 	Value TEXT
@@ -43,7 +79,9 @@ INSERT INTO Tag (TagName, Description) VALUES
 	('ungrouped',	'Special tag that applies to hosts that do not have a tag. In addition to any hosts assigned to this tag, it will always apply to every host that does not have a tag.');
 
 INSERT INTO Metadata (KeyName, Value) VALUES
-	('version', '0.1.6')
+	('version', '0.1.6'),
+	('generation', '0'),
+	('materialized', '0')
 ;
 
 CREATE VIEW HostHasTagView AS
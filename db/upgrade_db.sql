@@ -0,0 +1,41 @@
+-- Adds the tables that were added to the 0.1.6 database after it was first
+-- released to an existing database, without touching any of the data already
+-- in it. Tables that already exist are left alone, so it is safe to source
+-- this more than once.
+
+CREATE TABLE IF NOT EXISTS InventoryHost (
+	HostID INT NOT NULL PRIMARY KEY,
+	Hostname VARCHAR(255) NOT NULL,
+	Vars LONGTEXT NOT NULL,
+	INDEX (Hostname)
+);
+
+CREATE TABLE IF NOT EXISTS InventoryTag (
+	TagID INT NOT NULL PRIMARY KEY,
+	TagName VARCHAR(64) NOT NULL,
+	TagGroup VARCHAR(64),
+	Description TEXT,
+	Vars LONGTEXT NOT NULL,
+	Hosts LONGTEXT NOT NULL,
+	INDEX (TagGroup, TagName)
+);
+
+CREATE TABLE IF NOT EXISTS ChangeLog (
+	Seq BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+	ChangeTime TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+	ObjectType VARCHAR(8) NOT NULL,
+	ObjectID INT NOT NULL,
+	ObjectName VARCHAR(255) NOT NULL,
+	Action VARCHAR(32) NOT NULL,
+	Detail JSON NULL
+);
+
+CREATE TABLE IF NOT EXISTS HostVarIndex (
+	Path VARCHAR(255) NOT NULL PRIMARY KEY,
+	ColumnName VARCHAR(64) NOT NULL
+);
+
+INSERT IGNORE INTO Metadata (KeyName, Value) VALUES
+	('generation', '0'),
+	('materialized', '0')
+;
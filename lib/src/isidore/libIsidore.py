@@ -22,40 +22,107 @@
 
 import os
 import configparser
+import contextlib
+import importlib
 
-import mysql.connector
-import yaml
 import json
+import itertools
+import io
+import shutil
+import tempfile
+import mmap
+import struct
+import re
+import hashlib
+import ipaddress
+import threading
+import weakref
+
+# Stands in for a module that is only imported once one of its attributes is
+# first used. The MySQL connector and PyYAML take longer to import than the
+# rest of the command prompt put together, so commands that do not use them,
+# such as help, should not have to wait for them to load. The import itself is
+# done by importlib, which makes it safe to use from several threads.
+class _LazyModule:
+
+    # @param name       The full name of the module
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    # Only called for attributes that the stand-in itself doesn't have
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+_connector = _LazyModule('mysql.connector')
+yaml = _LazyModule('yaml')
 
 # Represents an Isidore database instance
 class Isidore:
 
-    _conn = None
+    _connection = None
+    _pool = None
+    _poolReturned = None
+    _session = None
     _version = '0.1.6'
     _db_user = None
     _db_host = None
     _db_name = None
+    _inventoryCache = None
+    _connectArgs = None
+    _prepared = False
+    _statements = None
 
-    # Connects to a MySQL database and creates a new Isidore object to interact
-    # with it.
+    # Creates a new Isidore object to interact with a MySQL database.
+    #
+    # By default, a single connection is used and the object must not be used
+    # by more than one thread at a time. The connection is not opened until
+    # the first query. If a pool size is given, a pool
+    # of connections is opened instead and the object, along with the Host and
+    # Tag objects it returns, can be shared between threads. Each thread
+    # checks a connection out of the pool the first time it uses the database
+    # and keeps it until it is done with it. See session(). A connection that
+    # is still checked out when its thread ends is returned to the pool. A
+    # thread that needs a connection while all of them are checked out waits
+    # for one to be returned.
     # @param user       The MySQL username
     # @param password   The password for the MySQL user
     # @param host       The MySQL server to connect to
     # @param database   The name of the database to use
-    def __init__(self, user, password, host, database):
+    # @param pool_size=None The number of connections to pool, or None to use
+    #                   a single connection
+    # @param use_pure=None  True to use the pure Python implementation of the
+    #                   MySQL connector even if its C extension is installed,
+    #                   False to require the C extension, or None to use the C
+    #                   extension only if it is installed
+    # @param prepared=True  True to run the most frequent lookups as server
+    #                   side prepared statements. See _query().
+    def __init__(self, user, password, host, database, pool_size=None,
+            use_pure=None, prepared=True):
         self._db_user = user
         self._db_host = host
         self._db_name = database
-        self._conn = mysql.connector.connect(
-                user = user,
-                password = password,
-                host = host,
-                database = database
-        )
-
-    # Loads the database credentials from a file. It then connects to the MySQL
-    # database specified by the config and creates a new Isidore object to
-    # interact with it.
+        self._connectArgs = {
+                'user': user,
+                'password': password,
+                'host': host,
+                'database': database
+        }
+        if use_pure is not None:
+            self._connectArgs['use_pure'] = use_pure
+        self._prepared = prepared
+        self._statements = dict()
+        self._session = _Session()
+        if pool_size is not None:
+            import mysql.connector.pooling
+            self._pool = mysql.connector.pooling.MySQLConnectionPool(
+                    pool_size = pool_size, **self._connectArgs)
+            self._poolReturned = threading.Condition()
+
+    # Loads the database credentials from a file and creates a new Isidore
+    # object to interact with the MySQL database specified by the config.
     #
     # If no file is specified, the standard Isidore system config files will be
     # tried in the following order. Any variables set in a file that is further
@@ -66,10 +133,17 @@ class Isidore:
     # - ~/.isidore.cfg
     # - ./isidore.cfg
     #
+    # The pool size can be set with the pool_size option in the [database]
+    # section of the file. The use_pure and prepared options of the same
+    # section turn on the pure Python MySQL connector and turn off prepared
+    # statements. See __init__().
+    #
     # @param file       The path to the file to load, or None to use the system
     #                   configuration.
+    # @param pool_size=None The number of connections to pool. Overrides the
+    #                   pool_size option of the file if given.
     @classmethod
-    def fromConfigFile(cls, file=None):
+    def fromConfigFile(cls, file=None, pool_size=None):
 
         # Read config file
         config = configparser.ConfigParser()
@@ -88,9 +162,47 @@ class Isidore:
         password = config['database']['password']
         host = config['database']['host']
         database = config['database']['database']
+        if pool_size is None:
+            pool_size = config['database'].getint('pool_size')
+        usePure = config['database'].getboolean('use_pure')
+        prepared = config['database'].getboolean('prepared', True)
 
         # Make the MySQL connection
-        return cls(user, password, host, database)
+        isidore = cls(user, password, host, database, pool_size, usePure,
+                prepared)
+
+        # Set the optional variables
+        if config.has_section('inventory'):
+            isidore._inventoryCache = config['inventory'].get('cache')
+
+        return isidore
+
+    # Groups the changes made inside a with block into a single transaction:
+    #
+    #   with isidore.batch():
+    #       isidore.createHost('web01')
+    #       isidore.getHost('web01').setVar('ansible_host', '10.1.0.1')
+    #
+    # The changes are committed together when the block ends, which refreshes
+    # the materialized inventory and increments the generation only once. If
+    # the block raises an exception, all of its changes are rolled back
+    # instead. A batch inside another batch joins the outer one. Changes that
+    # alter the schema, such as setVarIndex(), and newTransaction() commit
+    # right away and should not be used inside a batch.
+    # @return       A context manager for the batch
+    @contextlib.contextmanager
+    def batch(self):
+        self._session.batchDepth += 1
+        try:
+            yield self
+        except BaseException:
+            self._session.batchDepth -= 1
+            if self._session.batchDepth == 0:
+                self._rollback()
+            raise
+        self._session.batchDepth -= 1
+        if self._session.batchDepth == 0:
+            self._commit()
 
     # Creates a new host in the database
     # @param hostname           The hostname for the new host
@@ -98,18 +210,106 @@ class Isidore:
         cursor = self._conn.cursor()
         stmt = "INSERT INTO Host (Hostname) VALUES (%s)"
         cursor.execute(stmt, [ hostname ])
-        self._conn.commit()
+        self._markHost(cursor.lastrowid)
+        self._logChange('host', cursor.lastrowid, hostname, 'create')
+        self._commit()
         cursor.close()
 
+    # Creates several new hosts in the database at once. The hosts are
+    # inserted a chunk at a time and committed together; if any of them
+    # cannot be created, none of them are.
+    # @param hostnames          An iterable of the hostnames for the new hosts
+    def createHosts(self, hostnames):
+        with self.batch():
+            cursor = self._conn.cursor()
+            for chunk in _chunks(list(hostnames)):
+                cursor.executemany("INSERT INTO Host (Hostname) VALUES (%s)",
+                        [ [ hostname ] for hostname in chunk ])
+
+                # Look the IDs up since a multi-row insert only reports the
+                # first one
+                cursor.execute('SELECT Hostname, HostID FROM Host '
+                        'WHERE Hostname IN (' + _placeholders(chunk) + ')',
+                        chunk)
+                hostIds = dict(cursor.fetchall())
+                for hostname in chunk:
+                    self._markHost(hostIds[hostname])
+                    self._logChange('host', hostIds[hostname], hostname,
+                            'create')
+            cursor.close()
+
     # Creates a new tag in the database
     # @param name               The name for the new tag
     def createTag(self, name):
         cursor = self._conn.cursor()
         stmt = "INSERT INTO Tag (TagName) VALUES (%s)"
         cursor.execute(stmt, [ name ])
-        self._conn.commit()
+        self._markTag(cursor.lastrowid)
+        self._logChange('tag', cursor.lastrowid, name, 'create')
+        self._commit()
         cursor.close()
 
+    # Creates several new tags in the database at once. The tags are inserted
+    # a chunk at a time and committed together; if any of them cannot be
+    # created, none of them are.
+    # @param names              An iterable of the names for the new tags
+    def createTags(self, names):
+        with self.batch():
+            cursor = self._conn.cursor()
+            for chunk in _chunks(list(names)):
+                cursor.executemany("INSERT INTO Tag (TagName) VALUES (%s)",
+                        [ [ name ] for name in chunk ])
+
+                # Look the IDs up since a multi-row insert only reports the
+                # first one
+                cursor.execute('SELECT TagName, TagID FROM Tag '
+                        'WHERE TagName IN (' + _placeholders(chunk) + ')',
+                        chunk)
+                tagIds = dict(cursor.fetchall())
+                for name in chunk:
+                    self._markTag(tagIds[name])
+                    self._logChange('tag', tagIds[name], name, 'create')
+            cursor.close()
+
+    # Gets the changes made to hosts and tags after a given point in the change
+    # log. Every change made through libIsidore is recorded in the change log
+    # with a sequence number that goes up by one with each change, so a
+    # consumer can remember the sequence number of the last change it has
+    # seen and only read what changed after it.
+    # @param seq        The sequence number of the last change already seen,
+    #                   or 0 to get all the changes
+    # @param limit=None The maximum number of changes to get, or None to get
+    #                   all of them
+    # @return   A list of dictionaries, one for each change, in the order the
+    #           changes were made. Each one contains the sequence number
+    #           (seq), the time of the change (time), the type of object
+    #           changed (type, either 'host' or 'tag'), the ID (id) and name
+    #           (name) of the object, what was done to the object (action),
+    #           and the details of the change (detail), or None if there are
+    #           none.
+    # @throws mysql.connector.ProgrammingError  With errno 1146 if the
+    #           database was created before the change log was added
+    def getChangesSince(self, seq, limit=None):
+        stmt = '''\
+            SELECT
+                Seq,
+                ChangeTime,
+                ObjectType,
+                ObjectID,
+                ObjectName,
+                Action,
+                Detail
+            FROM ChangeLog
+            WHERE Seq > %s
+            ORDER BY Seq ASC
+            '''
+        params = [ seq ]
+        if limit != None:
+            stmt += 'LIMIT %s'
+            params.append(limit)
+
+        return self._getChanges(stmt, params)
+
     # Gets all the commissioned hosts in the database
     # @return   An array containing all the commissioned hosts in
     #           the database
@@ -184,13 +384,82 @@ class Isidore:
 
         return hosts
 
+    # Reads every host, tag, and tag assignment for dumping the database, such
+    # as for show config. Each is read with a single query whose rows are
+    # streamed from the server as they are consumed, so memory usage does not
+    # grow with the size of the database. The queries share a connection, so
+    # the generators must be consumed in full and in order.
+    # @return       A (hosts, tags, assignments) tuple of generators. They
+    #               yield tuples in the same form as the lists restore()
+    #               takes, but restore() reads its lists more than once, so
+    #               they have to be turned into lists before being passed to
+    #               it. hosts is sorted by hostname, tags by name, and
+    #               assignments by hostname and then tag name.
+    def getDump(self):
+        cursor = self._conn.cursor()
+
+        def hosts():
+            cursor.execute('''
+                    SELECT
+                        Hostname,
+                        CommissionDate,
+                        DecommissionDate,
+                        Description,
+                        Variables
+                    FROM Host
+                    ORDER BY Hostname ASC''')
+            yield from cursor
+
+        def tags():
+            cursor.execute('''
+                    SELECT
+                        TagName,
+                        TagGroup,
+                        Description,
+                        Variables
+                    FROM Tag
+                    ORDER BY TagName ASC''')
+            yield from cursor
+
+        def assignments():
+            cursor.execute('''
+                    SELECT
+                        Host.Hostname,
+                        Tag.TagName
+                    FROM HostHasTag
+                    INNER JOIN Host
+                        ON Host.HostID = HostHasTag.HostID
+                    INNER JOIN Tag
+                        ON Tag.TagID = HostHasTag.TagID
+                    ORDER BY
+                        Host.Hostname ASC,
+                        Tag.TagName ASC''')
+            yield from cursor
+            cursor.close()
+
+        return (hosts(), tags(), assignments())
+
+    # Gets the generation of the database. The generation starts at 0 and is
+    # incremented every time the database is modified through libIsidore, so
+    # it can be polled to cheaply find out whether anything has changed since
+    # it was last read.
+    # @return           The generation
+    def getGeneration(self):
+        cursor = self._conn.cursor()
+        cursor.execute("SELECT Value FROM Metadata WHERE KeyName = 'generation'")
+        row = cursor.fetchone()
+        cursor.close()
+
+        if row == None:
+            return 0
+        return int(row[0])
+
     # Gets a host in the database
     # @param hostname   The hostname of the system to get
     # @return           The Host object, or None if the host does
     #                   not exist.
     def getHost(self, hostname):
-        cursor = self._conn.cursor()
-        cursor.execute('''
+        rows = self._query('''
                 SELECT
                     HostID,
                     Hostname,
@@ -201,15 +470,55 @@ class Isidore:
                 WHERE Hostname = %s''',
                 [hostname])
 
-        row = cursor.fetchone()
-        if row == None:
+        if not rows:
             return None
 
-        host = Host(row[0], row[1], row[2], row[3], row[4],
+        row = rows[0]
+        return Host(row[0], row[1], row[2], row[3], row[4],
                 self)
-        cursor.fetchall()
+
+    # Gets a group of hosts by name, so that they can all be changed at once.
+    # See HostGroup.
+    # @param patterns   An iterable of hostnames. A name containing * or ? is
+    #                   a pattern that matches every host it fits. Patterns
+    #                   are case sensitive.
+    # @return           The HostGroup of the matching hosts. Names that don't
+    #                   match any host are left out.
+    def getHostGroup(self, patterns):
+        names = list()
+        wildcards = list()
+        for pattern in patterns:
+            if '*' in pattern or '?' in pattern:
+                wildcards.append(pattern)
+            else:
+                names.append(pattern)
+
+        stmt = '''
+                SELECT
+                    HostID,
+                    Hostname,
+                    CommissionDate,
+                    DecommissionDate,
+                    Description
+                FROM Host
+                WHERE '''
+        queries = [ (stmt + 'Hostname IN (' + _placeholders(chunk) + ')',
+                chunk) for chunk in _chunks(names) ]
+        queries += [ (stmt + "Hostname LIKE CAST(%s AS BINARY) ESCAPE '!'",
+                [ _likePattern(pattern) ]) for pattern in wildcards ]
+
+        hosts = dict()
+        cursor = self._conn.cursor()
+        for (query, params) in queries:
+            cursor.execute(query, params)
+            for (hostId, hostname, commissionDate, decommissionDate,
+                    description) in cursor:
+                hosts[hostId] = Host(hostId, hostname, commissionDate,
+                        decommissionDate, description, self)
         cursor.close()
-        return host
+
+        return HostGroup(sorted(hosts.values(),
+                key=lambda host: host.getHostname()), self)
 
     # Gets all the hosts in the database
     # @return   An array containing all the hosts in the database
@@ -234,130 +543,230 @@ class Isidore:
 
         return hosts
 
+    # Gets the commissioned hosts whose variable at a path compares to a value.
+    # The variable is compared as text, the way var print shows it but without
+    # quotes. The operators are:
+    #   =, !=           equal or not equal to the value
+    #   <, <=, >, >=    compared as numbers if the value is a number,
+    #                   otherwise compared as text
+    #   like            matches a pattern with * and ? wildcards
+    #   in              an IP address within the subnet given as the value,
+    #                   such as 10.1.0.0/16
+    # Hosts that don't have the variable never match. If the path is indexed
+    # (see setVarIndex()), the =, like, and in operators find the hosts
+    # through the index rather than by reading the variables of every host.
+    # @param path       The path of the variable
+    # @param operator   The operator
+    # @param value      The value to compare to
+    # @return           An array containing the matching hosts, sorted by
+    #                   hostname
+    # @throws ValueError    If the operator or subnet is invalid
+    def getHostsByVar(self, path, operator, value):
+        # Ensure the path starts with $
+        if path[0] != '$':
+            path = '$.' + path
+        if not isinstance(value, str):
+            value = json.dumps(value)
+
+        column = self._getVarIndexes().get(path)
+        variable = 'JSON_UNQUOTE(JSON_EXTRACT(Variables, %s))'
+        network = None
+
+        # The indexed column holds the first 255 characters of the variable,
+        # so a longer value has to be checked against the variable itself
+        if operator == '=' and column != None and len(value) < 255:
+            where = column + ' = %s'
+            params = [ value ]
+        elif operator == '=' and column != None:
+            where = column + ' = %s AND ' + variable + ' = %s'
+            params = [ value[:255], path, value ]
+        elif operator in [ '=', '!=' ]:
+            where = variable + ' ' + operator + ' %s'
+            params = [ path, value ]
+        elif operator in [ '<', '<=', '>', '>=' ]:
+            try:
+                params = [ path, float(value) ]
+                where = variable + ' + 0 ' + operator + ' %s'
+            except ValueError:
+                params = [ path, value ]
+                where = variable + ' ' + operator + ' %s'
+        elif operator == 'like':
+            where = variable + " LIKE %s ESCAPE '!'"
+            params = [ path, _likePattern(value) ]
+
+            # The index can narrow the hosts down by the part of the pattern
+            # before the first wildcard
+            prefix = re.split('[*?]', value)[0][:255]
+            if column != None and prefix != '':
+                where = column + " LIKE %s ESCAPE '!' AND " + where
+                params.insert(0, _likePattern(prefix) + '%')
+        elif operator == 'in':
+            try:
+                network = ipaddress.ip_network(value, strict=False)
+            except ValueError:
+                raise ValueError('Invalid subnet '+value)
+
+            # Narrow IPv4 addresses down by the octets the subnet covers
+            # completely. The addresses are checked against the subnet
+            # itself below.
+            octets = network.prefixlen // 8 if network.version == 4 else 0
+            prefix = '.'.join(str(network.network_address).split('.')[:octets])
+            prefix = _likePattern(prefix) + ('.%' if octets < 4 else '')
+            if octets == 0:
+                where = variable + ' IS NOT NULL'
+                params = [ path ]
+            elif column != None:
+                where = column + " LIKE %s ESCAPE '!'"
+                params = [ prefix ]
+            else:
+                where = variable + " LIKE %s ESCAPE '!'"
+                params = [ path, prefix ]
+        else:
+            raise ValueError('Invalid operator '+operator)
+
+        hosts = list()
+        cursor = self._conn.cursor()
+        cursor.execute('''
+                SELECT
+                    HostID,
+                    Hostname,
+                    CommissionDate,
+                    DecommissionDate,
+                    Description,
+                    ''' + variable + '''
+                FROM Host
+                WHERE DecommissionDate IS NULL AND ''' + where + '''
+                ORDER BY Hostname ASC''', [ path ] + params)
+        for (hostId, hostname, commissionDate, decommissionDate, description,
+                address) in cursor:
+            if network != None:
+                try:
+                    if ipaddress.ip_address(address) not in network:
+                        continue
+                except ValueError:
+                    continue
+            host = Host(hostId, hostname, commissionDate,
+                    decommissionDate, description, self)
+            hosts.append(host)
+        cursor.close()
+
+        return hosts
+
+    # Loads the tag assignments of all the commissioned hosts into a bitmap
+    # index that can select hosts by tag expressions such as
+    # "server and newark and not virtual". See HostSelector.
+    # @return       The HostSelector
+    def getHostSelector(self):
+        return HostSelector(self)
+
     # Builds an Ansible inventory in a dictionary representation
     # from all hosts and tags in the database
     # @return       the Ansible inventory dictionary
     #               representation 
     def getInventory(self):
-        inv = dict()
-
-        # Add all the hosts without a group header to ensure every
-        # system is included, even those without any tags.
-        inv['all'] = {
-                'hosts': list()
-        }
-        for host in self.getCommissionedHosts():
-            inv['all']['hosts'].append(host.getDetails())
-
-        # Add each tag and its hosts as a group
-        for tag in self.getTags(True):
-            name = tag.getName()
-            inv[name] = tag.getDetails()[name]
-
-        return inv
+        return self.getInventorySnapshot().getInventory()
 
     # Builds an Ansible INI inventory from all hosts and tags in
     # the database
     # @return       the Ansible inventory INI representation as a
     #               string
     def getInventoryIni(self):
-        inv = ""
-
-        # Add all the hosts without a group header to ensure every
-        # system is included, even those without any tags.
-        inv += "# All Host\n"
-        for host in self.getCommissionedHosts():
-            inv += host.getHostname() + "\n"
-        inv += "\n"
-
-        # Print each tag and its hosts as a group
-        for tag in self.getTags(True):
-            # Comment
-            group = tag.getGroup()
-            if group == None:
-                inv += "# "+tag.getName()+\
-                        " ("+str(tag.getDescription())+")\n"
-            else:
-                inv += "# "+tag.getGroup()+": "+tag.getName()+\
-                        " ("+str(tag.getDescription())+")\n"
-
-            # Header
-            inv += "["+tag.getName()+"]\n"
-
-            # Hosts
-            for host in tag.getHosts():
-                inv += host.getHostname() + "\n"
-            inv += "\n"
-
-        return inv
+        if self.getMaterialized():
+            out = io.StringIO()
+            self.writeInventoryIni(out)
+            return out.getvalue()
+        return self.getInventorySnapshot().getInventoryIni()
 
     # Builds an Ansible inventory in JSON format from all hosts
     # and tags in the database
+    # @param limit=None An Ansible style host pattern to limit the inventory
+    #                   to, or None for the full inventory. See
+    #                   getInventorySnapshot().
     # @return       the Ansible JSON inventory as a string
-    def getInventoryJson(self):
-        inv = dict()
-
-        # Add meta section
-        inv['_meta'] = {
-                'hostvars': {}
-        }
-
-        # Add all the hosts without a group header to ensure every
-        # system is included, even those without any tags.
-        inv['all'] = {
-                'hosts': list()
-        }
-        for host in self.getCommissionedHosts():
-            name = host.getHostname()
-            inv['all']['hosts'].append(name)
-            inv['_meta']['hostvars'][name] = host.getDetails()[name]['vars']
-
-        # Add each tag and its hosts as a group
-        for tag in self.getTags(True):
-            name = tag.getName()
-            inv[name] = tag.getDetails()[name]
+    def getInventoryJson(self, limit=None):
+        if limit != None:
+            return self.getInventorySnapshot(limit).getInventoryJson()
+        if self.getMaterialized():
+            out = io.StringIO()
+            self.writeInventoryJson(out)
+            return out.getvalue()
+        return self.getInventorySnapshot().getInventoryJson()
+
+    # Gets the on-disk cache for the JSON inventory, as configured by the
+    # cache option in the [inventory] section of the config file.
+    # @return       The InventoryCache, or None if no cache is configured
+    def getInventoryCache(self):
+        if not self._inventoryCache:
+            return None
+        return InventoryCache(self, self._inventoryCache)
 
-        return json.dumps(inv)
+    # Loads all the commissioned hosts, the tags, and the tag assignments into
+    # memory. The snapshot can then be used to build the inventory in any
+    # format without querying the database again.
+    #
+    # The snapshot can be limited to the hosts matching an Ansible style host
+    # pattern, in which case only those hosts, the tags assigned to them, and
+    # the all tag are loaded. The pattern is a list of hostnames and tag names
+    # separated by commas or colons, each of which may contain * and ?
+    # wildcards. A host matches if it matches any of the plain names, all of
+    # the names prefixed with &, and none of the names prefixed with !. For
+    # example, "newark:&server:!virtual". all and * match every host. The
+    # pattern is turned into SQL, so hosts that do not match are never read.
+    # @param limit=None The host pattern to limit the snapshot to, or None to
+    #                   load every commissioned host
+    # @return       The InventorySnapshot
+    # @throws ValueError    If the pattern is invalid
+    def getInventorySnapshot(self, limit=None):
+        return InventorySnapshot(self, limit)
 
     # Builds an Ansible inventory in YAML format from all hosts
     # and tags in the database
     # @return       the Ansible YAML inventory as a string
     def getInventoryYaml(self):
-        # Any variables assigned to the 'all' tag require special treatment
-        # since it goes at the top of the YAML tree unlike all the other tags.
-        tag_all = self.getTag('all')
-        inv = {
-                'all': {
-                    'hosts': dict(),
-                    'children': dict(),
-                    'vars': dict() if tag_all == None
-                        else tag_all.getDetails()['all']['vars']
-                }
-        }
-
-        # Add all the hosts without a group to ensure every system is included,
-        # even those without any tags.
-        for host in self.getCommissionedHosts():
-            name = host.getHostname()
-            inv['all']['hosts'][name] = host.getDetails()[name]['vars']
-
-        # Add each tag and its hosts as a group
-        for tag in self.getTags(True):
-            name = tag.getName()
-            details = tag.getDetails()
-            # Skip the all tag since it requires special care and is handled
-            # above
-            if name == 'all':
-                continue
-            inv['all']['children'][name] = {
-                    'hosts': dict.fromkeys(details[name]['hosts'], dict()),
-                    'vars': details[name]['vars']
-            }
-
-        # Generate YAML output without any anchors/aliases
-        noalias_dumper = yaml.dumper.SafeDumper
-        noalias_dumper.ignore_aliases = lambda self, data: True
-        return yaml.dump(inv, default_flow_style=False, Dumper=noalias_dumper)
+        if self.getMaterialized():
+            out = io.StringIO()
+            self.writeInventoryYaml(out)
+            return out.getvalue()
+        return self.getInventorySnapshot().getInventoryYaml()
+
+    # Gets the most recent changes made to hosts and tags. See
+    # getChangesSince().
+    # @param count      The number of changes to get
+    # @return   A list of dictionaries, one for each change, in the order the
+    #           changes were made, the same as getChangesSince()
+    # @throws mysql.connector.ProgrammingError  With errno 1146 if the
+    #           database was created before the change log was added
+    def getLastChanges(self, count):
+        return self._getChanges('''\
+            SELECT *
+            FROM (
+                SELECT
+                    Seq,
+                    ChangeTime,
+                    ObjectType,
+                    ObjectID,
+                    ObjectName,
+                    Action,
+                    Detail
+                FROM ChangeLog
+                ORDER BY Seq DESC
+                LIMIT %s
+            ) AS LastChange
+            ORDER BY Seq ASC
+            ''', [ count ])
+
+    # Checks whether the inventory is materialized. When it is, the variables
+    # of every commissioned host and the variables and host list of every tag
+    # are kept precomputed in the InventoryHost and InventoryTag tables, and
+    # the inventory is read from those tables instead of being built from
+    # the Host, Tag, and HostHasTag tables.
+    # @return       True if the inventory is materialized, otherwise False
+    def getMaterialized(self):
+        cursor = self._conn.cursor()
+        cursor.execute("SELECT Value FROM Metadata WHERE KeyName = 'materialized'")
+        row = cursor.fetchone()
+        cursor.close()
+        return row != None and row[0] == '1'
 
     # Gets the message of the day from the database
     # @return           The message of the day, or None if there isn't one
@@ -393,13 +802,20 @@ class Isidore:
 
         return row[0]
 
+    # Gets the number of pooled connections. See __init__().
+    # @return           The size of the connection pool, or None if a single
+    #                   connection is used
+    def getPoolSize(self):
+        if self._pool is None:
+            return None
+        return self._pool.pool_size
+
     # Gets a tag in the database
     # @param name       The name of the tag to get
     # @return           The Tag object, or None if the tag does
     #                   not exist.
     def getTag(self, name):
-        cursor = self._conn.cursor()
-        cursor.execute('''
+        rows = self._query('''
             SELECT
                 TagId,
                 TagName,
@@ -409,15 +825,12 @@ class Isidore:
             WHERE TagName = %s''',
             [name])
 
-        row = cursor.fetchone()
-        if row == None:
+        if not rows:
             return None
 
-        tag = Tag(row[0], row[1], row[2], row[3], 
+        row = rows[0]
+        return Tag(row[0], row[1], row[2], row[3],
                 self)
-        cursor.fetchall()
-        cursor.close()
-        return tag
 
     # Gets all the tag groups in the database and which tags
     # belong to them.
@@ -502,6 +915,11 @@ class Isidore:
 
         return tags
 
+    # Gets the host variable paths that are indexed. See setVarIndex().
+    # @return       A sorted list of the indexed paths
+    def getVarIndexes(self):
+        return sorted(self._getVarIndexes())
+
     # Gets the libIsidore version
     # @return       The libIsidore version
     def getVersion(self):
@@ -517,13 +935,174 @@ class Isidore:
         self._conn.commit()
         self._conn.start_transaction()
 
+    # Reconnects to the database after the connection to it has been lost.
+    # The statements prepared on the old connection are forgotten. With a
+    # pool, only the connection of the current thread is reconnected.
+    # @param attempts=1     The number of times to try to reconnect
+    # @param delay=0        The number of seconds to wait between attempts
+    def reconnect(self, attempts=1, delay=0):
+        self._getStatements().clear()
+        self._conn.reconnect(attempts=attempts, delay=delay)
+
+    # Loads hosts, tags, and tag assignments in bulk, such as when restoring a
+    # dump made with show config. Everything is inserted with multi-row
+    # inserts and committed at once; if anything fails, nothing is changed.
+    # Hosts and tags that already exist are overwritten with the given
+    # attributes, and tag assignments that already exist are left alone.
+    # @param hosts      A list of (hostname, commission date, decommission
+    #                   date, description, variables) tuples. The variables
+    #                   are a JSON string.
+    # @param tags       A list of (name, group, description, variables)
+    #                   tuples. The variables are a JSON string.
+    # @param assignments    A list of (hostname, tag name) tuples
+    # @throws ValueError    If an assignment refers to a host or tag that
+    #                   does not exist
+    def restore(self, hosts, tags, assignments):
+        with self.batch():
+            cursor = self._conn.cursor()
+
+            # Tags
+            cursor.execute('SELECT TagName, TagID FROM Tag')
+            tagIds = dict(cursor.fetchall())
+            existingTags = set(tagIds)
+            for chunk in _chunks( [ tag for tag in tags
+                    if tag[0] not in tagIds ] ):
+                cursor.executemany('''
+                        INSERT INTO Tag (TagName, TagGroup, Description,
+                            Variables)
+                        VALUES (%s, %s, %s, %s)''', chunk)
+            for chunk in _chunks( [ tag[1:] + tag[:1] for tag in tags
+                    if tag[0] in tagIds ] ):
+                cursor.executemany('''
+                        UPDATE Tag
+                        SET TagGroup = %s, Description = %s, Variables = %s
+                        WHERE TagName = %s''', chunk)
+
+            # Hosts
+            cursor.execute('SELECT Hostname, HostID FROM Host')
+            hostIds = dict(cursor.fetchall())
+            existingHosts = set(hostIds)
+            for chunk in _chunks( [ host for host in hosts
+                    if host[0] not in hostIds ] ):
+                cursor.executemany('''
+                        INSERT INTO Host (Hostname, CommissionDate,
+                            DecommissionDate, Description, Variables)
+                        VALUES (%s, %s, %s, %s, %s)''', chunk)
+            for chunk in _chunks( [ host[1:] + host[:1] for host in hosts
+                    if host[0] in hostIds ] ):
+                cursor.executemany('''
+                        UPDATE Host
+                        SET CommissionDate = %s, DecommissionDate = %s,
+                            Description = %s, Variables = %s
+                        WHERE Hostname = %s''', chunk)
+
+            # Look the IDs up since a multi-row insert only reports the first
+            # one
+            cursor.execute('SELECT TagName, TagID FROM Tag')
+            tagIds = dict(cursor.fetchall())
+            cursor.execute('SELECT Hostname, HostID FROM Host')
+            hostIds = dict(cursor.fetchall())
+
+            # Tag assignments
+            cursor.execute('SELECT HostID, TagID FROM HostHasTag')
+            assigned = set(cursor.fetchall())
+            hostTags = dict()
+            pairs = list()
+            for (hostname, name) in assignments:
+                if hostname not in hostIds:
+                    raise ValueError('Host '+hostname+' does not exist')
+                if name not in tagIds:
+                    raise ValueError('Tag '+name+' does not exist')
+                pair = (hostIds[hostname], tagIds[name])
+                hostTags.setdefault(hostname, list()).append(name)
+                if pair not in assigned:
+                    assigned.add(pair)
+                    pairs.append(pair)
+            for chunk in _chunks(pairs):
+                cursor.executemany('''
+                        INSERT INTO HostHasTag (HostID, TagID)
+                        VALUES (%s, %s)''', chunk)
+            cursor.close()
+
+            # Overwriting a tag that already existed may change its group,
+            # which is part of the variables of its hosts, and overwriting a
+            # host may change its decommission date, which decides whether it
+            # is in the host lists of its tags. New tag assignments change
+            # both sides.
+            for tag in tags:
+                self._markTag(tagIds[tag[0]], tag[0] in existingTags)
+                self._logChange('tag', tagIds[tag[0]], tag[0], 'restore')
+            for (hostId, tagId) in pairs:
+                self._markHost(hostId)
+                self._markTag(tagId)
+            for host in hosts:
+                self._markHost(hostIds[host[0]], host[0] in existingHosts)
+                self._logChange('host', hostIds[host[0]], host[0], 'restore',
+                        { 'tags': hostTags.get(host[0], list()) })
+
+    # Holds on to a connection from the pool for the duration of a with block
+    # and returns it to the pool when the block ends:
+    #
+    #   with isidore.session():
+    #       host = isidore.getHost('web01')
+    #       ...
+    #
+    # This is meant for threads that only use the database now and then, such
+    # as the workers of a thread pool, so that they do not keep a connection
+    # checked out while they are idle. A thread that uses the database outside
+    # of a session keeps its connection until it ends, and the connection is
+    # returned to the pool once the thread is gone. If the thread already
+    # holds a connection when the block starts, it keeps holding it
+    # afterwards. Without a pool, this does nothing.
+    # @return       A context manager for the session
+    @contextlib.contextmanager
+    def session(self):
+        if self._pool is None or self._session.conn is not None:
+            yield self
+            return
+        try:
+            yield self
+        finally:
+            self._release()
+
+    # Turns materialization of the inventory on or off. See getMaterialized().
+    # Turning it on fills the InventoryHost and InventoryTag tables from
+    # scratch, which can also be used to rebuild them if the database has
+    # been modified without going through this library. Afterwards, only the
+    # rows affected by each change made through the library are refreshed.
+    # @param enabled        True to materialize the inventory, False to stop
+    #                       materializing it
+    def setMaterialized(self, enabled):
+        cursor = self._conn.cursor()
+        stmt = "REPLACE INTO Metadata (KeyName, Value) VALUES ('materialized', %s)"
+        cursor.execute(stmt, [ '1' if enabled else '0' ])
+        cursor.execute("DELETE FROM InventoryHost")
+        cursor.execute("DELETE FROM InventoryTag")
+
+        if enabled:
+            snapshot = self.getInventorySnapshot()
+            hosts = [ (host.hostId, host.hostname,
+                    json.dumps(snapshot._hostVars(host)))
+                    for host in snapshot._hosts ]
+            tags = [ (tag.tagId, tag.name, tag.group, tag.description,
+                    json.dumps(snapshot._tagVars(tag)),
+                    json.dumps(snapshot._tagHostnames(tag)))
+                    for tag in snapshot._tags ]
+            self._insertMaterialized(cursor, hosts, tags)
+
+        # Everything is up to date now
+        self._session.dirtyHosts.clear()
+        self._session.dirtyTags.clear()
+        self._commit()
+        cursor.close()
+
     # Sets the message of the day
     # @param motd           The message of the day
     def setMotd(self, motd):
         cursor = self._conn.cursor()
         stmt = "REPLACE INTO Metadata (KeyName, Value) VALUES ('motd', %s)"
         cursor.execute(stmt, [ motd ])
-        self._conn.commit()
+        self._commit()
         cursor.close()
 
     # Sets the name of the Isidore instance
@@ -532,7 +1111,856 @@ class Isidore:
         cursor = self._conn.cursor()
         stmt = "REPLACE INTO Metadata (KeyName, Value) VALUES ('name', %s)"
         cursor.execute(stmt, [ name ])
+        self._commit()
+        cursor.close()
+
+    # Indexes a host variable path, or stops indexing it. An indexed path is
+    # backed by a generated column on the Host table that holds the first 255
+    # characters of the variable as text, and an index on that column, which
+    # getHostsByVar() uses to find hosts. Since this alters the Host table,
+    # any pending changes are committed along with it, and it can take a
+    # while on a large database.
+    # @param path       The path of the variable. Only paths made up of names
+    #                   and array indexes, such as os.release or
+    #                   $.interfaces[0].address, can be indexed.
+    # @param enabled    True to index the path, False to drop its index
+    # @throws ValueError    If the path cannot be indexed
+    def setVarIndex(self, path, enabled):
+        # Ensure the path starts with $
+        if path[0] != '$':
+            path = '$.' + path
+
+        # The path is part of the column definition rather than a parameter,
+        # so only allow paths that are safe to put there
+        if len(path) > 255 or not _indexablePath.fullmatch(path):
+            raise ValueError('The path '+path+' cannot be indexed')
+
+        if (path in self._getVarIndexes()) == enabled:
+            return
+        column = 'Var_' + hashlib.sha1(path.encode()).hexdigest()[:16]
+
+        cursor = self._conn.cursor()
+        if enabled:
+            cursor.execute('''
+                    ALTER TABLE Host
+                    ADD COLUMN ''' + column + ''' VARCHAR(255)
+                        CHARACTER SET utf8mb4 COLLATE utf8mb4_bin
+                        GENERATED ALWAYS AS (LEFT(JSON_UNQUOTE(
+                            JSON_EXTRACT(Variables, \'''' + path + '''\')), 255))
+                        VIRTUAL''')
+            cursor.execute('CREATE INDEX '+column+' ON Host ('+column+')')
+            cursor.execute('''
+                    INSERT INTO HostVarIndex (Path, ColumnName)
+                    VALUES (%s, %s)''', [ path, column ])
+        else:
+            cursor.execute('DROP INDEX '+column+' ON Host')
+            cursor.execute('ALTER TABLE Host DROP COLUMN '+column)
+            cursor.execute('DELETE FROM HostVarIndex WHERE Path = %s', [ path ])
+        self._commit()
+        cursor.close()
+
+    # Commits the current transaction, incrementing the generation of the
+    # database along with it. Every method that modifies the database commits
+    # through this method. The materialized inventory rows of the hosts and
+    # tags marked by the change are refreshed, and the change is recorded in
+    # the change log, in the same transaction. Inside a batch, nothing is
+    # committed until the batch ends. See batch().
+    def _commit(self):
+        if self._session.batchDepth > 0:
+            return
+
+        # The generation row is bumped first and stays locked until the
+        # commit, so committing transactions run one at a time from here on.
+        # The materialized rows are then rebuilt from the base rows as the
+        # last transaction to commit left them, and the change log entries
+        # are numbered in the order the transactions commit in. A reader that
+        # has seen a sequence number will never have an entry with a lower
+        # number show up afterwards.
+        cursor = self._conn.cursor()
+        cursor.execute('''
+                INSERT INTO Metadata (KeyName, Value) VALUES ('generation', '1')
+                ON DUPLICATE KEY UPDATE Value = CAST(Value AS UNSIGNED) + 1''')
+
+        if self._session.dirtyHosts or self._session.dirtyTags:
+            self._refreshMaterialized()
+
+        try:
+            for chunk in _chunks(self._session.changes):
+                cursor.executemany('''
+                        INSERT INTO ChangeLog
+                            (ObjectType, ObjectID, ObjectName, Action, Detail)
+                        VALUES (%s, %s, %s, %s, %s)''', chunk)
+        except _connector.ProgrammingError as e:
+            # Databases created before the change log was added don't have
+            # the ChangeLog table until db/upgrade_db.sql is run. The changes
+            # still get committed, they just aren't logged.
+            if e.errno != 1146:
+                raise
+        self._session.changes = list()
+
+        cursor.close()
         self._conn.commit()
+
+    # The connection used by the current thread. Without a pool, the
+    # connection is opened the first time it is needed. With a pool, a
+    # connection is checked out of it the first time the thread needs one.
+    @property
+    def _conn(self):
+        if self._pool is None:
+            if self._connection is None:
+                self._connection = _connector.connect(
+                        **self._connectArgs)
+            return self._connection
+
+        session = self._session
+        if session.conn is None:
+            with self._poolReturned:
+                while True:
+                    try:
+                        conn = self._pool.get_connection()
+                        break
+                    except _connector.PoolError:
+                        self._poolReturned.wait()
+
+            # The session of a thread is thrown away when the thread ends, so
+            # the connection goes back to the pool then if the thread never
+            # returned it itself
+            session.checkout = _Checkout()
+            session.checkout.release = weakref.finalize(session.checkout,
+                    self._returnConnection, conn)
+            session.checkout.release.atexit = False
+            session.conn = conn
+        return session.conn
+
+    # Runs a query on the change log and reads the changes it returns
+    # @param stmt       The statement to run, which must select the columns
+    #                   of the ChangeLog table in the order they are defined
+    # @param params     The parameters of the statement
+    # @return   A list of dictionaries, one for each change. See
+    #           getChangesSince().
+    def _getChanges(self, stmt, params):
+        changes = list()
+
+        cursor = self._conn.cursor()
+        cursor.execute(stmt, params)
+        for (seq, time, objectType, objectId, name, action, detail) in cursor:
+            changes.append({
+                'seq': seq,
+                'time': time,
+                'type': objectType,
+                'id': objectId,
+                'name': name,
+                'action': action,
+                'detail': json.loads(detail) if detail is not None else None
+            })
+        cursor.close()
+
+        return changes
+
+    # Gets the statements prepared on the connection of the current thread
+    # @return       A dictionary of (statement, cursor) tuples keyed by the
+    #               statement
+    def _getStatements(self):
+        if self._pool is None:
+            return self._statements
+        return self._session.statements
+
+    # Gets the indexed host variable paths
+    # @return       A dictionary of the generated column names keyed by path
+    def _getVarIndexes(self):
+        cursor = self._conn.cursor()
+        try:
+            cursor.execute('SELECT Path, ColumnName FROM HostVarIndex')
+            indexes = dict(cursor.fetchall())
+        except _connector.ProgrammingError as e:
+            # Databases created before variable indexes were added don't have
+            # the HostVarIndex table until db/upgrade_db.sql is run, so no
+            # paths are indexed.
+            if e.errno != 1146:
+                raise
+            indexes = dict()
+        cursor.close()
+        return indexes
+
+    # Inserts rows into the materialized inventory tables
+    # @param cursor     The cursor to insert the rows with
+    # @param hosts      A list of (HostID, Hostname, Vars) tuples
+    # @param tags       A list of (TagID, TagName, TagGroup, Description,
+    #                   Vars, Hosts) tuples
+    def _insertMaterialized(self, cursor, hosts, tags):
+        for chunk in _chunks(hosts):
+            cursor.executemany('''
+                    INSERT INTO InventoryHost (HostID, Hostname, Vars)
+                    VALUES (%s, %s, %s)''', chunk)
+        for chunk in _chunks(tags):
+            cursor.executemany('''
+                    INSERT INTO InventoryTag
+                        (TagID, TagName, TagGroup, Description, Vars, Hosts)
+                    VALUES (%s, %s, %s, %s, %s, %s)''', chunk)
+
+    # Records a change in the change log when it is committed
+    # @param objectType     The type of object that was changed, either 'host'
+    #                       or 'tag'
+    # @param objectId       The ID of the object
+    # @param name           The name of the object after the change
+    # @param action         What was done to the object
+    # @param detail=None    A JSON serializable value with the details of the
+    #                       change, or None if there are none
+    def _logChange(self, objectType, objectId, name, action, detail=None):
+        self._session.changes.append( (objectType, objectId, name, action,
+                json.dumps(detail) if detail is not None else None) )
+
+    # Marks a host as changed so that its materialized inventory row is
+    # refreshed when the change is committed
+    # @param hostId     The ID of the host
+    # @param tags=False If true, the host lists of the tags assigned to the
+    #                   host are refreshed as well. This is needed when the
+    #                   hostname or the decommission date changes.
+    def _markHost(self, hostId, tags=False):
+        dirtyHosts = self._session.dirtyHosts
+        dirtyHosts[hostId] = dirtyHosts.get(hostId, False) or tags
+
+    # Marks a tag as changed so that its materialized inventory row is
+    # refreshed when the change is committed
+    # @param tagId      The ID of the tag
+    # @param hosts=False    If true, the variables of the hosts assigned to the
+    #                   tag are refreshed as well. This is needed when the name
+    #                   or the group of the tag changes.
+    def _markTag(self, tagId, hosts=False):
+        dirtyTags = self._session.dirtyTags
+        dirtyTags[tagId] = dirtyTags.get(tagId, False) or hosts
+
+    # Runs a query and reads all of its rows. This is used for the lookups
+    # that are run over and over, such as getHost() and Host.getVar(). With
+    # prepared statements turned on, a query is prepared on the server the
+    # first time it is run on a connection, and the prepared statement is
+    # reused each time the same query is run on that connection afterwards,
+    # so that the server does not parse it again.
+    # @param stmt       The SQL statement
+    # @param params     The parameters of the statement
+    # @return           A list of the rows
+    def _query(self, stmt, params):
+        if not self._prepared:
+            cursor = self._conn.cursor()
+            cursor.execute(stmt, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+
+        # The connector only reuses the prepared statement of a cursor if it
+        # is given the same string object the statement was prepared from,
+        # so that one is kept along with the cursor.
+        statements = self._getStatements()
+        if stmt in statements:
+            (stmt, cursor) = statements[stmt]
+        else:
+            cursor = self._conn.cursor(prepared=True)
+            statements[stmt] = (stmt, cursor)
+        try:
+            cursor.execute(stmt, params)
+            return cursor.fetchall()
+        except BaseException:
+            del statements[stmt]
+            raise
+
+    # Returns the connection of the current thread to the pool. Anything it
+    # has not committed is rolled back.
+    def _release(self):
+        session = self._session
+        conn = session.conn
+        session.conn = None
+        session.statements.clear()
+        session.dirtyHosts.clear()
+        session.dirtyTags.clear()
+        session.changes = list()
+        session.checkout.release()
+        session.checkout = None
+
+    # Returns a connection to the pool and wakes up a thread waiting for one.
+    # Anything it has not committed is rolled back.
+    # @param conn       The pooled connection to return
+    def _returnConnection(self, conn):
+        try:
+            conn.close()
+        finally:
+            with self._poolReturned:
+                self._poolReturned.notify()
+
+    # Rolls back the current transaction, along with the hosts and tags marked
+    # by it and the changes queued for the change log
+    def _rollback(self):
+        self._session.dirtyHosts.clear()
+        self._session.dirtyTags.clear()
+        self._session.changes = list()
+        self._conn.rollback()
+
+    # Refreshes the materialized inventory rows of the hosts and tags that
+    # have been marked as changed, if the inventory is materialized. The base
+    # rows are read with locking reads, which see the latest committed rows
+    # rather than the snapshot the transaction started with. This must only
+    # be called with the generation row locked. See _commit().
+    def _refreshMaterialized(self):
+        dirtyHosts = self._session.dirtyHosts
+        dirtyTags = self._session.dirtyTags
+        self._session.dirtyHosts = dict()
+        self._session.dirtyTags = dict()
+        if not self.getMaterialized():
+            return
+
+        cursor = self._conn.cursor()
+        hostIds = set(dirtyHosts)
+        tagIds = set(dirtyTags)
+
+        # Pull in the tags of hosts and the hosts of tags whose rows depend on
+        # what changed
+        for chunk in _chunks([ h for h in dirtyHosts if dirtyHosts[h] ]):
+            cursor.execute('''
+                    SELECT TagID
+                    FROM HostHasTag
+                    WHERE HostID IN (%s)
+                    LOCK IN SHARE MODE''' % _placeholders(chunk), chunk)
+            tagIds.update( row[0] for row in cursor )
+        for chunk in _chunks([ t for t in dirtyTags if dirtyTags[t] ]):
+            cursor.execute('''
+                    SELECT HostID
+                    FROM HostHasTag
+                    WHERE TagID IN (%s)
+                    LOCK IN SHARE MODE''' % _placeholders(chunk), chunk)
+            hostIds.update( row[0] for row in cursor )
+
+        # Rebuild the host rows. Hosts that have been deleted or
+        # decommissioned are left out.
+        for chunk in _chunks(sorted(hostIds)):
+            cursor.execute('''
+                    SELECT
+                        Host.HostID,
+                        Host.Hostname,
+                        Host.CommissionDate,
+                        Host.DecommissionDate,
+                        Host.Description,
+                        Host.Variables,
+                        Tag.TagName,
+                        Tag.TagGroup
+                    FROM Host
+                    LEFT JOIN HostHasTag
+                        ON Host.HostID = HostHasTag.HostID
+                    LEFT JOIN Tag
+                        ON HostHasTag.TagID = Tag.TagID
+                    WHERE
+                        Host.HostID IN (%s) AND
+                        Host.DecommissionDate IS NULL
+                    ORDER BY
+                        Host.HostID ASC,
+                        Tag.TagGroup ASC,
+                        Tag.TagName ASC
+                    LOCK IN SHARE MODE''' % _placeholders(chunk), chunk)
+            hosts = list()
+            for (hostId, rows) in itertools.groupby(cursor,
+                    lambda row: row[0]):
+                rows = list(rows)
+                (hostId, hostname, commissionDate, decommissionDate,
+                        description, variables) = rows[0][0:6]
+                hostvars = _buildHostVars(variables, commissionDate,
+                        decommissionDate, description,
+                        ( (row[6], row[7]) for row in rows
+                            if row[6] is not None ))
+                hosts.append( (hostId, hostname, json.dumps(hostvars)) )
+
+            cursor.execute('''
+                    DELETE FROM InventoryHost
+                    WHERE HostID IN (%s)''' % _placeholders(chunk), chunk)
+            self._insertMaterialized(cursor, hosts, [])
+
+        # Rebuild the tag rows. Tags that have been deleted are left out.
+        for chunk in _chunks(sorted(tagIds)):
+            cursor.execute('''
+                    SELECT
+                        Tag.TagID,
+                        Tag.TagName,
+                        Tag.TagGroup,
+                        Tag.Description,
+                        Tag.Variables,
+                        Host.Hostname
+                    FROM Tag
+                    LEFT JOIN (HostHasTag
+                        INNER JOIN Host
+                            ON Host.HostID = HostHasTag.HostID
+                            AND Host.DecommissionDate IS NULL)
+                        ON HostHasTag.TagID = Tag.TagID
+                    WHERE Tag.TagID IN (%s)
+                    ORDER BY
+                        Tag.TagID ASC,
+                        Host.Hostname ASC
+                    LOCK IN SHARE MODE''' % _placeholders(chunk), chunk)
+            tags = list()
+            for (tagId, rows) in itertools.groupby(cursor,
+                    lambda row: row[0]):
+                rows = list(rows)
+                (tagId, name, group, description, variables) = rows[0][0:5]
+                tagvars = _buildTagVars(name, group, description, variables)
+                hostnames = [ row[5] for row in rows if row[5] is not None ]
+                tags.append( (tagId, name, group, description,
+                        json.dumps(tagvars), json.dumps(hostnames)) )
+
+            cursor.execute('''
+                    DELETE FROM InventoryTag
+                    WHERE TagID IN (%s)''' % _placeholders(chunk), chunk)
+            self._insertMaterialized(cursor, [], tags)
+
+        cursor.close()
+
+    # Writes the Ansible INI inventory to a file object as the rows are read
+    # from the database. The output is identical to getInventoryIni(), but
+    # the tags and their hosts are read with a single query and nothing is
+    # held in memory.
+    # @param out        The file object to write the inventory to
+    def writeInventoryIni(self, out):
+        if self.getMaterialized():
+            self._writeInventoryIniMaterialized(out)
+            return
+
+        cursor = self._conn.cursor()
+
+        # The queries are run as the writer gets to each section, so the
+        # hosts have been read in full before the tags are queried.
+        def hostnames():
+            cursor.execute('''
+                    SELECT Hostname
+                    FROM Host
+                    WHERE DecommissionDate IS NULL
+                    ORDER BY Hostname ASC''')
+            for (hostname,) in cursor:
+                yield hostname
+
+        def tags():
+            cursor.execute('''
+                    SELECT
+                        Tag.TagName,
+                        Tag.TagGroup,
+                        Tag.Description,
+                        Host.Hostname
+                    FROM Tag
+                    LEFT JOIN (HostHasTag
+                        INNER JOIN Host
+                            ON Host.HostID = HostHasTag.HostID
+                            AND Host.DecommissionDate IS NULL)
+                        ON HostHasTag.TagID = Tag.TagID
+                    ORDER BY
+                        Tag.TagGroup ASC,
+                        Tag.TagName ASC,
+                        Host.Hostname ASC''')
+            for ((name, group, description), rows) in \
+                    itertools.groupby(cursor, lambda row: row[0:3]):
+                yield (name, group, description,
+                        ( row[3] for row in rows if row[3] is not None ))
+
+        _writeInventoryIni(out, hostnames(), tags())
+        cursor.close()
+
+    # Writes the Ansible inventory in JSON format to a file object as the rows
+    # are read from the database. The output is identical to
+    # getInventoryJson(), but only one host or tag is held in memory at a
+    # time, so memory usage does not grow with the size of the inventory.
+    # @param out        The file object to write the inventory to
+    # @param limit=None An Ansible style host pattern to limit the inventory
+    #                   to, or None for the full inventory. See
+    #                   getInventorySnapshot(). A limited inventory is built
+    #                   in memory, since it only holds the matching hosts.
+    def writeInventoryJson(self, out, limit=None):
+        if limit != None:
+            out.write(self.getInventoryJson(limit))
+            return
+        if self.getMaterialized():
+            self._writeInventoryJsonMaterialized(out)
+            return
+
+        cursor = self._conn.cursor()
+
+        # The _meta and all sections are replaced by the tag of the same name
+        # if there is one, just like in getInventoryJson().
+        out.write('{')
+        for key in [ '_meta', 'all' ]:
+            if key == 'all':
+                out.write(', ')
+            out.write(json.dumps(key) + ': ')
+
+            cursor.execute('''
+                    SELECT
+                        Tag.TagName,
+                        Tag.TagGroup,
+                        Tag.Description,
+                        Tag.Variables,
+                        Host.Hostname
+                    FROM Tag
+                    LEFT JOIN (HostHasTag
+                        INNER JOIN Host
+                            ON Host.HostID = HostHasTag.HostID
+                            AND Host.DecommissionDate IS NULL)
+                        ON HostHasTag.TagID = Tag.TagID
+                    WHERE Tag.TagName = %s
+                    ORDER BY Host.Hostname ASC''',
+                    [ key ])
+            rows = cursor.fetchmany(1)
+            if rows != []:
+                self._writeInventoryJsonTags(out, rows, cursor, False)
+
+            elif key == '_meta':
+                # Add meta section
+                out.write('{"hostvars": {')
+                cursor.execute('''
+                        SELECT
+                            Host.Hostname,
+                            Host.CommissionDate,
+                            Host.DecommissionDate,
+                            Host.Description,
+                            Host.Variables,
+                            Tag.TagName,
+                            Tag.TagGroup
+                        FROM Host
+                        LEFT JOIN HostHasTag
+                            ON Host.HostID = HostHasTag.HostID
+                        LEFT JOIN Tag
+                            ON HostHasTag.TagID = Tag.TagID
+                        WHERE Host.DecommissionDate IS NULL
+                        ORDER BY
+                            Host.Hostname ASC,
+                            Tag.TagGroup ASC,
+                            Tag.TagName ASC''')
+                name = None
+                hostvars = None
+                for (hostname, commissionDate, decommissionDate, description,
+                        variables, tagName, tagGroup) in cursor:
+                    # The rows for each host are consecutive. Write out the
+                    # previous host once all of its rows have been read.
+                    if hostname != name:
+                        if name is not None:
+                            out.write(json.dumps(name) + ': ' +
+                                    json.dumps(hostvars) + ', ')
+                        name = hostname
+                        hostvars = json.loads(variables)
+                        hostvars['isidore'] = {
+                            'commissioned': str(commissionDate)
+                                if commissionDate is not None else None,
+                            'decommissioned': str(decommissionDate)
+                                if decommissionDate is not None else None,
+                            'description': description,
+                            'tags': {}
+                        }
+
+                    if tagName is not None:
+                        group = tagGroup if tagGroup is not None \
+                                else 'ungrouped'
+                        tags = hostvars['isidore']['tags']
+                        if group not in tags:
+                            tags[group] = list()
+                        tags[group].append(tagName)
+
+                if name is not None:
+                    out.write(json.dumps(name) + ': ' + json.dumps(hostvars))
+                out.write('}}')
+
+            else:
+                # Add all the hosts without a group header to ensure every
+                # system is included, even those without any tags.
+                out.write('{"hosts": [')
+                cursor.execute('''
+                        SELECT Hostname
+                        FROM Host
+                        WHERE DecommissionDate IS NULL
+                        ORDER BY Hostname ASC''')
+                first = True
+                for (hostname,) in cursor:
+                    if not first:
+                        out.write(', ')
+                    out.write(json.dumps(hostname))
+                    first = False
+                out.write(']}')
+
+        # Add each tag and its hosts as a group
+        cursor.execute('''
+                SELECT
+                    Tag.TagName,
+                    Tag.TagGroup,
+                    Tag.Description,
+                    Tag.Variables,
+                    Host.Hostname
+                FROM Tag
+                LEFT JOIN (HostHasTag
+                    INNER JOIN Host
+                        ON Host.HostID = HostHasTag.HostID
+                        AND Host.DecommissionDate IS NULL)
+                    ON HostHasTag.TagID = Tag.TagID
+                WHERE Tag.TagName NOT IN ('_meta', 'all')
+                ORDER BY
+                    Tag.TagGroup ASC,
+                    Tag.TagName ASC,
+                    Host.Hostname ASC''')
+        self._writeInventoryJsonTags(out, cursor.fetchmany(1), cursor, True)
+        out.write('}')
+        cursor.close()
+
+    # Writes the Ansible inventory in YAML format to a file object as the rows
+    # are read from the database. The output is identical to
+    # getInventoryYaml(), but only one host or tag is held in memory at a time.
+    # @param out        The file object to write the inventory to
+    def writeInventoryYaml(self, out):
+        if self.getMaterialized():
+            self._writeInventoryYamlMaterialized(out)
+            return
+
+        cursor = self._conn.cursor()
+
+        # Any variables assigned to the 'all' tag require special treatment
+        # since it goes at the top of the YAML tree unlike all the other tags.
+        tag_all = self.getTag('all')
+        allVars = dict()
+        if tag_all != None:
+            allVars = tag_all.getVar()
+            allVars['isidore_tag_all'] = {
+                    'description': tag_all.getDescription(),
+                    'group': tag_all.getGroup()
+            }
+
+        # Each tag and its hosts. yaml.dump() sorts mapping keys by code
+        # point, so the rows are sorted by the binary value of the names.
+        def children():
+            cursor.execute('''
+                    SELECT
+                        Tag.TagName,
+                        Tag.TagGroup,
+                        Tag.Description,
+                        Tag.Variables,
+                        Host.Hostname
+                    FROM Tag
+                    LEFT JOIN (HostHasTag
+                        INNER JOIN Host
+                            ON Host.HostID = HostHasTag.HostID
+                            AND Host.DecommissionDate IS NULL)
+                        ON HostHasTag.TagID = Tag.TagID
+                    WHERE Tag.TagName != 'all'
+                    ORDER BY
+                        BINARY Tag.TagName ASC,
+                        BINARY Host.Hostname ASC''')
+            for (name, rows) in itertools.groupby(cursor, lambda row: row[0]):
+                (name, group, description, variables, hostname) = next(rows)
+                tagvars = json.loads(variables)
+                tagvars['isidore_tag_'+name] = {
+                        'description': description,
+                        'group': group
+                }
+                hostnames = itertools.chain( [ hostname ],
+                        ( row[4] for row in rows ) )
+                yield (name, tagvars,
+                        ( h for h in hostnames if h is not None ))
+
+        # Each commissioned host along with its variables
+        def hosts():
+            cursor.execute('''
+                    SELECT
+                        Host.Hostname,
+                        Host.CommissionDate,
+                        Host.DecommissionDate,
+                        Host.Description,
+                        Host.Variables,
+                        Tag.TagName,
+                        Tag.TagGroup
+                    FROM Host
+                    LEFT JOIN HostHasTag
+                        ON Host.HostID = HostHasTag.HostID
+                    LEFT JOIN Tag
+                        ON HostHasTag.TagID = Tag.TagID
+                    WHERE Host.DecommissionDate IS NULL
+                    ORDER BY
+                        BINARY Host.Hostname ASC,
+                        Tag.TagGroup ASC,
+                        Tag.TagName ASC''')
+            for (name, rows) in itertools.groupby(cursor, lambda row: row[0]):
+                hostvars = None
+                for (hostname, commissionDate, decommissionDate, description,
+                        variables, tagName, tagGroup) in rows:
+                    if hostvars is None:
+                        hostvars = json.loads(variables)
+                        hostvars['isidore'] = {
+                            'commissioned': str(commissionDate)
+                                if commissionDate is not None else None,
+                            'decommissioned': str(decommissionDate)
+                                if decommissionDate is not None else None,
+                            'description': description,
+                            'tags': {}
+                        }
+                    if tagName is not None:
+                        group = tagGroup if tagGroup is not None \
+                                else 'ungrouped'
+                        tags = hostvars['isidore']['tags']
+                        if group not in tags:
+                            tags[group] = list()
+                        tags[group].append(tagName)
+                yield (name, hostvars)
+
+        _writeInventoryYaml(out, allVars, children(), hosts())
+        cursor.close()
+
+    # Writes the Ansible INI inventory to a file object from the materialized
+    # inventory tables
+    # @param out        The file object to write the inventory to
+    def _writeInventoryIniMaterialized(self, out):
+        cursor = self._conn.cursor()
+
+        def hostnames():
+            cursor.execute('''
+                    SELECT Hostname
+                    FROM InventoryHost
+                    ORDER BY Hostname ASC''')
+            for (hostname,) in cursor:
+                yield hostname
+
+        def tags():
+            cursor.execute('''
+                    SELECT TagName, TagGroup, Description, Hosts
+                    FROM InventoryTag
+                    ORDER BY TagGroup ASC, TagName ASC''')
+            for (name, group, description, hosts) in cursor:
+                yield (name, group, description, json.loads(hosts))
+
+        _writeInventoryIni(out, hostnames(), tags())
+        cursor.close()
+
+    # Writes the Ansible inventory in JSON format to a file object from the
+    # materialized inventory tables. The stored JSON is written out as is
+    # without being decoded.
+    # @param out        The file object to write the inventory to
+    def _writeInventoryJsonMaterialized(self, out):
+        cursor = self._conn.cursor()
+
+        # The _meta and all sections are replaced by the tag of the same name
+        # if there is one, just like in getInventoryJson().
+        out.write('{')
+        for key in [ '_meta', 'all' ]:
+            if key == 'all':
+                out.write(', ')
+            out.write(json.dumps(key) + ': ')
+
+            cursor.execute('''
+                    SELECT Vars, Hosts
+                    FROM InventoryTag
+                    WHERE TagName = %s''',
+                    [ key ])
+            row = cursor.fetchone()
+            cursor.fetchall()
+            if row != None:
+                out.write('{"vars": ' + row[0] + ', "hosts": ' + row[1] + '}')
+
+            elif key == '_meta':
+                out.write('{"hostvars": {')
+                cursor.execute('''
+                        SELECT Hostname, Vars
+                        FROM InventoryHost
+                        ORDER BY Hostname ASC''')
+                first = True
+                for (hostname, hostvars) in cursor:
+                    if not first:
+                        out.write(', ')
+                    out.write(json.dumps(hostname) + ': ' + hostvars)
+                    first = False
+                out.write('}}')
+
+            else:
+                out.write('{"hosts": [')
+                cursor.execute('''
+                        SELECT Hostname
+                        FROM InventoryHost
+                        ORDER BY Hostname ASC''')
+                first = True
+                for (hostname,) in cursor:
+                    if not first:
+                        out.write(', ')
+                    out.write(json.dumps(hostname))
+                    first = False
+                out.write(']}')
+
+        # Add each tag and its hosts as a group
+        cursor.execute('''
+                SELECT TagName, Vars, Hosts
+                FROM InventoryTag
+                WHERE TagName NOT IN ('_meta', 'all')
+                ORDER BY TagGroup ASC, TagName ASC''')
+        for (name, tagvars, hosts) in cursor:
+            out.write(', ' + json.dumps(name) + ': {"vars": ' + tagvars +
+                    ', "hosts": ' + hosts + '}')
+        out.write('}')
+        cursor.close()
+
+    # Writes tags and their hosts for writeInventoryJson(). The rows for each
+    # tag must be consecutive and contain the tag name, group, description,
+    # variables, and hostname (or None if the tag has no hosts).
+    # @param out        The file object to write the tags to
+    # @param rows       The rows that have already been fetched from cursor
+    # @param cursor     The cursor to read the remaining rows from
+    # @param keyed      If True, write each tag as a "name": {...} pair
+    #                   preceded by a comma. Otherwise write only the value
+    #                   of the single tag.
+    def _writeInventoryJsonTags(self, out, rows, cursor, keyed):
+        name = None
+        for (tagName, tagGroup, description, variables, hostname) in \
+                itertools.chain(rows, cursor):
+            if tagName != name:
+                if name is not None:
+                    out.write(']}')
+                name = tagName
+                tagvars = json.loads(variables)
+                tagvars['isidore_tag_'+name] = {
+                        'description': description,
+                        'group': tagGroup
+                }
+                if keyed:
+                    out.write(', ' + json.dumps(name) + ': ')
+                out.write('{"vars": ' + json.dumps(tagvars) + ', "hosts": [')
+                first = True
+
+            if hostname is not None:
+                if not first:
+                    out.write(', ')
+                out.write(json.dumps(hostname))
+                first = False
+
+        if name is not None:
+            out.write(']}')
+
+    # Writes the Ansible inventory in YAML format to a file object from the
+    # materialized inventory tables
+    # @param out        The file object to write the inventory to
+    def _writeInventoryYamlMaterialized(self, out):
+        cursor = self._conn.cursor()
+
+        # The variables of the 'all' tag go at the top of the YAML tree
+        cursor.execute('''
+                SELECT Vars
+                FROM InventoryTag
+                WHERE TagName = 'all\'''')
+        row = cursor.fetchone()
+        cursor.fetchall()
+        allVars = dict() if row == None else json.loads(row[0])
+
+        # yaml.dump() sorts mapping keys by code point, so the rows are sorted
+        # by the binary value of the names.
+        def children():
+            cursor.execute('''
+                    SELECT TagName, Vars, Hosts
+                    FROM InventoryTag
+                    WHERE TagName != 'all'
+                    ORDER BY BINARY TagName ASC''')
+            for (name, tagvars, hosts) in cursor:
+                yield (name, json.loads(tagvars), sorted(json.loads(hosts)))
+
+        def hosts():
+            cursor.execute('''
+                    SELECT Hostname, Vars
+                    FROM InventoryHost
+                    ORDER BY BINARY Hostname ASC''')
+            for (hostname, hostvars) in cursor:
+                yield (hostname, json.loads(hostvars))
+
+        _writeInventoryYaml(out, allVars, children(), hosts())
         cursor.close()
 
 # An individual host
@@ -566,37 +1994,61 @@ class Host:
         cursor = self._isidore._conn.cursor()
         stmt = "INSERT INTO HostHasTag (HostID, TagID) VALUES (%s, %s)"
         cursor.execute(stmt, [ self._hostId, tag.getTagId() ])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId)
+        self._isidore._markTag(tag.getTagId())
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'tag add', { 'tag': tag.getName() })
+        self._isidore._commit()
         cursor.close()
 
-    # Appends an item to a list variable
+    # Adds several tags to this host at once. If any of them cannot be added,
+    # such as because the host already has it, none of them are.
+    # @param tags       An iterable of the tag objects to add
+    def addTags(self, tags):
+        tags = list(tags)
+        with self._isidore.batch():
+            cursor = self._isidore._conn.cursor()
+            for chunk in _chunks(tags):
+                cursor.executemany(
+                        "INSERT INTO HostHasTag (HostID, TagID) VALUES (%s, %s)",
+                        [ [ self._hostId, tag.getTagId() ] for tag in chunk ])
+            cursor.close()
+
+            self._isidore._markHost(self._hostId)
+            for tag in tags:
+                self._isidore._markTag(tag.getTagId())
+                self._isidore._logChange('host', self._hostId, self._hostname,
+                        'tag add', { 'tag': tag.getName() })
+
+    # Appends items to a list variable
     # @param path       The path of the list to append to.
     # @param value      The value to append to the list. This can
     #                   be of any type that is JSON serializable.
-    def appendVar(self, path, value):
+    # @param values     Any further values to append after it, all in the
+    #                   same statement
+    def appendVar(self, path, value, *values):
         # Ensure the path starts with $
         if path[0] != '$':
             path = '$.' + path
+        values = (value,) + values
 
-        # Set the variable
+        # Append the values. JSON_ARRAY_APPEND takes a path and a value for
+        # each item, and appends them in order.
+        items = ', '.join( [ "%s, JSON_EXTRACT(%s, '$')" ] * len(values) )
         stmt = '''
             UPDATE Host
-            SET Variables =
-                JSON_ARRAY_APPEND(
-                    (SELECT Variables
-                        FROM (SELECT * FROM Host) AS temp
-                        WHERE HostId = %s),
-                    %s,
-                    JSON_EXTRACT(%s, '$')
-                )
+            SET Variables = JSON_ARRAY_APPEND(Variables, ''' + items + ''')
             WHERE HostID = %s'''
+        params = list()
+        for value in values:
+            params += [ path, json.dumps(value) ]
         cursor = self._isidore._conn.cursor()
-        cursor.execute(stmt, [
-            self._hostId,
-            path,
-            json.dumps(value),
-            self._hostId])
-        self._isidore._conn.commit()
+        cursor.execute(stmt, params + [ self._hostId ])
+        self._isidore._markHost(self._hostId)
+        for value in values:
+            self._isidore._logChange('host', self._hostId, self._hostname,
+                    'var append', { 'path': path, 'value': value })
+        self._isidore._commit()
         cursor.close()
 
     # Deletes this host from the database. The host object should
@@ -606,7 +2058,10 @@ class Host:
         cursor = self._isidore._conn.cursor()
         stmt = "DELETE FROM Host WHERE HostID = %s"
         cursor.execute(stmt, [ self._hostId ])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId, True)
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'delete')
+        self._isidore._commit()
         cursor.close()
 
         # Blank out all the fields in case the object is
@@ -671,6 +2126,63 @@ class Host:
     def getDescription(self):
         return self._description
 
+    # Gets the variables the host ends up with in Ansible. These are the
+    # variables of the all tag, overridden by the variables of each of the
+    # host's tags, overridden by the host's own variables, including the
+    # variables Isidore adds to each of them in the inventory. As in Ansible,
+    # the ungrouped tag only applies to a host without any other tags, whether
+    # or not the host is assigned to it. The tags are applied in the order
+    # Ansible applies groups: by ansible_group_priority and then by name. As
+    # in Ansible, variables are overridden as a whole rather than merged.
+    # Everything is read with a single query.
+    # @return   A dictionary containing the effective variables, or None if
+    #           the host no longer exists
+    def getEffectiveVars(self):
+        stmt = '''\
+            SELECT
+                Host.Variables,
+                Host.CommissionDate,
+                Host.DecommissionDate,
+                Host.Description,
+                Tag.TagName,
+                Tag.TagGroup,
+                Tag.Description,
+                Tag.Variables,
+                HostHasTag.TagID IS NOT NULL
+            FROM Host
+            CROSS JOIN Tag
+            LEFT JOIN HostHasTag
+                ON HostHasTag.HostID = Host.HostID AND
+                    HostHasTag.TagID = Tag.TagID
+            WHERE
+                Host.HostID = %s AND
+                (HostHasTag.TagID IS NOT NULL OR
+                    Tag.TagName IN ('all', 'ungrouped'))
+            ORDER BY Tag.TagGroup ASC, Tag.TagName ASC
+            '''
+        cursor = self._isidore._conn.cursor()
+        cursor.execute(stmt, [self._hostId])
+        rows = cursor.fetchall()
+        cursor.close()
+        if rows == []:
+            return None
+
+        # Every row repeats the host's columns along with one tag
+        (variables, commissionDate, decommissionDate, description) = \
+                rows[0][:4]
+        applied = _appliedTags([ row[4] for row in rows if row[8] ])
+        layers = [ (name, _buildTagVars(name, group, tagDescription,
+                    tagVariables))
+                for (name, group, tagDescription, tagVariables) in
+                    ( row[4:8] for row in rows )
+                if name in applied ]
+
+        effective = _mergeTagVars(layers)
+        effective.update(_buildHostVars(variables, commissionDate,
+                decommissionDate, description,
+                ( row[4:6] for row in rows if row[8] )))
+        return effective
+
     # Gets all the tags assigned to this host
     # @param groupSort=False    If true, sort the tags first by
     #                           group name and then by tag name.
@@ -697,12 +2209,10 @@ class Host:
         else:
             stmt += 'ORDER BY TagName ASC'
 
-        cursor = self._isidore._conn.cursor()
-        cursor.execute(stmt, [self._hostId])
-        for (tagId, name, group, description) in cursor:
-            tag = Tag(tagId, name, group, description)
+        for (tagId, name, group, description) in self._isidore._query(stmt,
+                [self._hostId]):
+            tag = Tag(tagId, name, group, description, self._isidore)
             tags.append(tag)
-        cursor.close()
 
         return tags
 
@@ -722,10 +2232,7 @@ class Host:
         # Select the JSON
         stmt = 'SELECT JSON_EXTRACT(Variables, %s) \
                 FROM Host WHERE HostID = %s'
-        cursor = self._isidore._conn.cursor()
-        cursor.execute(stmt, [path, self._hostId])
-        row = cursor.fetchone()
-        cursor.close()
+        row = self._isidore._query(stmt, [path, self._hostId])[0]
 
         # Decode the JSON and return
         if row[0] == None:
@@ -744,7 +2251,11 @@ class Host:
                 TagId = %s
             '''
         cursor.execute(stmt, [ self._hostId, tag.getTagId() ])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId)
+        self._isidore._markTag(tag.getTagId())
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'tag remove', { 'tag': tag.getName() })
+        self._isidore._commit()
         cursor.close()
 
     # Sets the host's commission date
@@ -753,7 +2264,10 @@ class Host:
         cursor = self._isidore._conn.cursor()
         stmt = "UPDATE Host SET CommissionDate = %s WHERE HostID = %s"
         cursor.execute(stmt, [ date, self._hostId ])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId)
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'set commissioned', { 'date': str(date) })
+        self._isidore._commit()
         cursor.close()
         self._commissionDate = date
 
@@ -764,7 +2278,11 @@ class Host:
         cursor = self._isidore._conn.cursor()
         stmt = "UPDATE Host SET DecommissionDate = %s WHERE HostID = %s"
         cursor.execute(stmt, [ date, self._hostId ])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId, True)
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'set decommissioned',
+                { 'date': str(date) if date is not None else None })
+        self._isidore._commit()
         cursor.close()
         self._decommissionDate = date
 
@@ -774,7 +2292,10 @@ class Host:
         cursor = self._isidore._conn.cursor()
         stmt = "UPDATE Host SET Description = %s WHERE HostID = %s"
         cursor.execute(stmt, [ description, self._hostId ])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId)
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'set description', { 'description': description })
+        self._isidore._commit()
         cursor.close()
         self._description = description
 
@@ -784,7 +2305,10 @@ class Host:
         cursor = self._isidore._conn.cursor()
         stmt = "UPDATE Host SET Hostname = %s WHERE HostID = %s"
         cursor.execute(stmt, [ hostname, self._hostId ])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId, True)
+        self._isidore._logChange('host', self._hostId, hostname, 'rename',
+                { 'from': self._hostname })
+        self._isidore._commit()
         cursor.close()
         self._hostname = hostname
 
@@ -813,7 +2337,10 @@ class Host:
             WHERE HostID = %s'''
         cursor = self._isidore._conn.cursor()
         cursor.execute(stmt, [path, json.dumps(value), self._hostId])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId)
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'var set', { 'path': path, 'value': value })
+        self._isidore._commit()
         cursor.close()
 
     # Unsets a variable.
@@ -834,7 +2361,10 @@ class Host:
             WHERE HostID = %s'''
         cursor = self._isidore._conn.cursor()
         cursor.execute(stmt, [path, self._hostId])
-        self._isidore._conn.commit()
+        self._isidore._markHost(self._hostId)
+        self._isidore._logChange('host', self._hostId, self._hostname,
+                'var unset', { 'path': path })
+        self._isidore._commit()
         cursor.close()
 
 # An individual tag
@@ -860,34 +2390,57 @@ class Tag:
         self._description = description
         self._isidore = isidore
 
-    # Appends an item to a list variable
+    # Assigns several hosts to this tag at once. If any of them cannot be
+    # assigned, such as because the host already has this tag, none of them
+    # are.
+    # @param hosts      An iterable of the host objects to assign
+    def addHosts(self, hosts):
+        hosts = list(hosts)
+        with self._isidore.batch():
+            cursor = self._isidore._conn.cursor()
+            for chunk in _chunks(hosts):
+                cursor.executemany(
+                        "INSERT INTO HostHasTag (HostID, TagID) VALUES (%s, %s)",
+                        [ [ host.getHostId(), self._tagId ] for host in chunk ])
+            cursor.close()
+
+            # The change is logged against each host, the same as
+            # Host.addTag() does
+            self._isidore._markTag(self._tagId)
+            for host in hosts:
+                self._isidore._markHost(host.getHostId())
+                self._isidore._logChange('host', host.getHostId(),
+                        host.getHostname(), 'tag add', { 'tag': self._name })
+
+    # Appends items to a list variable
     # @param path       The path of the list to append to.
     # @param value      The value to append to the list. This can
     #                   be of any type that is JSON serializable.
-    def appendVar(self, path, value):
+    # @param values     Any further values to append after it, all in the
+    #                   same statement
+    def appendVar(self, path, value, *values):
         # Ensure the path starts with $
         if path[0] != '$':
             path = '$.' + path
+        values = (value,) + values
 
-        # Set the variable
+        # Append the values. JSON_ARRAY_APPEND takes a path and a value for
+        # each item, and appends them in order.
+        items = ', '.join( [ "%s, JSON_EXTRACT(%s, '$')" ] * len(values) )
         stmt = '''
             UPDATE Tag
-            SET Variables =
-                JSON_ARRAY_APPEND(
-                    (SELECT Variables
-                        FROM (SELECT * FROM Tag) AS temp
-                        WHERE TagId = %s),
-                    %s,
-                    JSON_EXTRACT(%s, '$')
-                )
+            SET Variables = JSON_ARRAY_APPEND(Variables, ''' + items + ''')
             WHERE TagID = %s'''
+        params = list()
+        for value in values:
+            params += [ path, json.dumps(value) ]
         cursor = self._isidore._conn.cursor()
-        cursor.execute(stmt, [
-            self._tagId,
-            path,
-            json.dumps(value),
-            self._tagId])
-        self._isidore._conn.commit()
+        cursor.execute(stmt, params + [ self._tagId ])
+        self._isidore._markTag(self._tagId)
+        for value in values:
+            self._isidore._logChange('tag', self._tagId, self._name,
+                    'var append', { 'path': path, 'value': value })
+        self._isidore._commit()
         cursor.close()
 
     # Deletes this tag from the database. The tag object should
@@ -897,7 +2450,9 @@ class Tag:
         cursor = self._isidore._conn.cursor()
         stmt = "DELETE FROM Tag WHERE TagID = %s"
         cursor.execute(stmt, [ self._tagId ])
-        self._isidore._conn.commit()
+        self._isidore._markTag(self._tagId, True)
+        self._isidore._logChange('tag', self._tagId, self._name, 'delete')
+        self._isidore._commit()
         cursor.close()
 
         # Blank out all the fields in case the object is
@@ -969,13 +2524,11 @@ class Tag:
             ORDER BY Hostname ASC
             '''
 
-        cursor = self._isidore._conn.cursor()
-        cursor.execute(stmt, [self._tagId])
-        for (hostId, hostname, commissionDate, decommissionDate, description) in cursor:
+        for (hostId, hostname, commissionDate, decommissionDate, description) in \
+                self._isidore._query(stmt, [self._tagId]):
             host = Host(hostId, hostname, commissionDate,
-                    decommissionDate, description, self)
+                    decommissionDate, description, self._isidore)
             hosts.append(host)
-        cursor.close()
 
         return hosts
 
@@ -995,10 +2548,7 @@ class Tag:
         # Select the JSON
         stmt = 'SELECT JSON_EXTRACT(Variables, %s) \
                 FROM Tag WHERE TagID = %s'
-        cursor = self._isidore._conn.cursor()
-        cursor.execute(stmt, [path, self._tagId])
-        row = cursor.fetchone()
-        cursor.close()
+        row = self._isidore._query(stmt, [path, self._tagId])[0]
 
         # Decode the JSON and return
         if row[0] == None:
@@ -1012,7 +2562,10 @@ class Tag:
         cursor = self._isidore._conn.cursor()
         stmt = "UPDATE Tag SET Description = %s WHERE TagID = %s"
         cursor.execute(stmt, [ description, self._tagId ])
-        self._isidore._conn.commit()
+        self._isidore._markTag(self._tagId)
+        self._isidore._logChange('tag', self._tagId, self._name,
+                'set description', { 'description': description })
+        self._isidore._commit()
         cursor.close()
         self._description = description
 
@@ -1023,7 +2576,10 @@ class Tag:
         cursor = self._isidore._conn.cursor()
         stmt = "UPDATE Tag SET TagGroup = %s WHERE TagID = %s"
         cursor.execute(stmt, [ group, self._tagId ])
-        self._isidore._conn.commit()
+        self._isidore._markTag(self._tagId, True)
+        self._isidore._logChange('tag', self._tagId, self._name,
+                'set group', { 'group': group })
+        self._isidore._commit()
         cursor.close()
         self._group = group
 
@@ -1033,7 +2589,10 @@ class Tag:
         cursor = self._isidore._conn.cursor()
         stmt = "UPDATE Tag SET TagName = %s WHERE TagID = %s"
         cursor.execute(stmt, [ name, self._tagId ])
-        self._isidore._conn.commit()
+        self._isidore._markTag(self._tagId, True)
+        self._isidore._logChange('tag', self._tagId, name, 'rename',
+                { 'from': self._name })
+        self._isidore._commit()
         cursor.close()
         self._name = name
 
@@ -1062,7 +2621,10 @@ class Tag:
             WHERE TagID = %s'''
         cursor = self._isidore._conn.cursor()
         cursor.execute(stmt, [path, json.dumps(value), self._tagId])
-        self._isidore._conn.commit()
+        self._isidore._markTag(self._tagId)
+        self._isidore._logChange('tag', self._tagId, self._name,
+                'var set', { 'path': path, 'value': value })
+        self._isidore._commit()
         cursor.close()
 
     # Unsets a variable.
@@ -1083,6 +2645,1301 @@ class Tag:
             WHERE TagID = %s'''
         cursor = self._isidore._conn.cursor()
         cursor.execute(stmt, [path, self._tagId])
-        self._isidore._conn.commit()
+        self._isidore._markTag(self._tagId)
+        self._isidore._logChange('tag', self._tagId, self._name,
+                'var unset', { 'path': path })
+        self._isidore._commit()
+        cursor.close()
+
+# A group of hosts that are changed together. Each change is made to every host
+# in the group with one statement per chunk of hosts, and all of it is
+# committed at once.
+class HostGroup:
+
+    _hosts = None
+    _isidore = None
+
+    # Creates a new host group. This should not be called directly; use
+    # Isidore.getHostGroup() instead.
+    # @param hosts      The host objects in the group
+    # @param isidore    The Isidore object the hosts belong to
+    def __init__(self, hosts, isidore):
+        self._hosts = list(hosts)
+        self._isidore = isidore
+
+    # Adds a tag to every host in the group. Hosts that already have the tag
+    # are skipped.
+    # @param tag        The tag object to add
+    def addTag(self, tag):
+        self.addTags([ tag ])
+
+    # Adds several tags to every host in the group. Hosts that already have
+    # one of the tags are skipped for that tag.
+    # @param tags       An iterable of the tag objects to add
+    def addTags(self, tags):
+        with self._isidore.batch():
+            cursor = self._isidore._conn.cursor()
+            for tag in tags:
+                cursor.execute('SELECT HostID FROM HostHasTag WHERE TagID = %s',
+                        [ tag.getTagId() ])
+                tagged = set( [ hostId for (hostId,) in cursor.fetchall() ] )
+                hosts = [ host for host in self._hosts
+                        if host.getHostId() not in tagged ]
+
+                for chunk in _chunks(hosts):
+                    cursor.executemany('''
+                            INSERT INTO HostHasTag (HostID, TagID)
+                            VALUES (%s, %s)''',
+                            [ [ host.getHostId(), tag.getTagId() ]
+                                for host in chunk ])
+
+                self._isidore._markTag(tag.getTagId())
+                for host in hosts:
+                    self._isidore._markHost(host.getHostId())
+                    self._isidore._logChange('host', host.getHostId(),
+                            host.getHostname(), 'tag add',
+                            { 'tag': tag.getName() })
+            cursor.close()
+
+    # Gets the hosts in the group
+    # @return           A list of the host objects, sorted by hostname
+    def getHosts(self):
+        return list(self._hosts)
+
+    # Sets the decommission date of every host in the group
+    # @param date       The decommission date, or None to mark the hosts as
+    #                   commissioned
+    def setDecommissionDate(self, date):
+        with self._isidore.batch():
+            cursor = self._isidore._conn.cursor()
+            for chunk in _chunks(self._hosts):
+                cursor.execute('UPDATE Host SET DecommissionDate = %s '
+                        'WHERE HostID IN (' + _placeholders(chunk) + ')',
+                        [ date ] + [ host.getHostId() for host in chunk ])
+            cursor.close()
+
+            for host in self._hosts:
+                self._isidore._markHost(host.getHostId(), True)
+                self._isidore._logChange('host', host.getHostId(),
+                        host.getHostname(), 'set decommissioned',
+                        { 'date': str(date) if date is not None else None })
+                host._decommissionDate = date
+
+    # Sets a variable on every host in the group
+    # @param path       The path of the variable to set. See Host.setVar().
+    # @param value      The value to set the variable to. This can be of any
+    #                   type that is JSON serializable.
+    def setVar(self, path, value):
+        # Ensure the path starts with $
+        if path[0] != '$':
+            path = '$.' + path
+
+        with self._isidore.batch():
+            cursor = self._isidore._conn.cursor()
+            for chunk in _chunks(self._hosts):
+                cursor.execute('''
+                    UPDATE Host
+                    SET Variables =
+                        JSON_SET(
+                            Variables,
+                            %s,
+                            JSON_EXTRACT(%s, '$')
+                        )
+                    WHERE HostID IN (''' + _placeholders(chunk) + ')',
+                    [ path, json.dumps(value) ] +
+                        [ host.getHostId() for host in chunk ])
+            cursor.close()
+
+            for host in self._hosts:
+                self._isidore._markHost(host.getHostId())
+                self._isidore._logChange('host', host.getHostId(),
+                        host.getHostname(), 'var set',
+                        { 'path': path, 'value': value })
+
+# The state an Isidore object keeps for each thread using it: the connection
+# checked out of the pool by the thread, if any, along with the statements
+# prepared on it, and the changes made by the thread that have not been
+# committed yet.
+class _Session(threading.local):
+
+    def __init__(self):
+        self.conn = None
+        self.checkout = None
+        self.statements = dict()
+        self.dirtyHosts = dict()
+        self.dirtyTags = dict()
+        self.changes = list()
+        self.batchDepth = 0
+
+# A connection checked out of the pool by a thread. Only the thread's session
+# refers to it, so it is garbage collected along with the session when the
+# thread ends, and release then returns the connection to the pool.
+class _Checkout:
+
+    def __init__(self):
+        self.release = None
+
+# A host as it is stored in an InventorySnapshot. The variables are kept as the
+# JSON string from the database until they are needed, and the tags are stored
+# as indices into the snapshot's tag list.
+class _SnapshotHost:
+
+    __slots__ = ('hostId', 'hostname', 'commissionDate', 'decommissionDate',
+            'description', 'variables', 'tags')
+
+    def __init__(self, hostId, hostname, commissionDate, decommissionDate,
+            description, variables):
+        self.hostId = hostId
+        self.hostname = hostname
+        self.commissionDate = commissionDate
+        self.decommissionDate = decommissionDate
+        self.description = description
+        self.variables = variables
+        self.tags = list()
+
+# A tag as it is stored in an InventorySnapshot. The variables are kept as the
+# JSON string from the database until they are needed, and the hosts are stored
+# as indices into the snapshot's host list.
+class _SnapshotTag:
+
+    __slots__ = ('tagId', 'name', 'group', 'description', 'variables',
+            'hosts')
+
+    def __init__(self, tagId, name, group, description, variables):
+        self.tagId = tagId
+        self.name = name
+        self.group = group
+        self.description = description
+        self.variables = variables
+        self.hosts = list()
+
+# An in-memory copy of everything needed to build the Ansible inventory: the
+# commissioned hosts, the tags, the tag assignments between them, and their
+# variables. It is loaded with a fixed number of queries regardless of the size
+# of the inventory, and the inventory can then be built from it in any format
+# any number of times without touching the database again.
+class InventorySnapshot:
+
+    _hosts = None
+    _tags = None
+    _hostIndex = None
+    _tagIndex = None
+    _generation = None
+    _tagLayers = None
+
+    # Loads a new snapshot from the database
+    # @param isidore    The Isidore object to load the snapshot from
+    # @param limit=None The host pattern to limit the snapshot to, or None to
+    #                   load every commissioned host. See
+    #                   Isidore.getInventorySnapshot().
+    def __init__(self, isidore, limit=None):
+        self._hosts = list()
+        self._tags = list()
+        self._hostIndex = dict()
+        self._tagIndex = dict()
+        self._tagLayers = dict()
+        (where, params) = _limitCondition(limit)
+        self._generation = isidore.getGeneration()
+        cursor = isidore._conn.cursor()
+
+        # Load all the commissioned hosts along with their variables. The
+        # order of this list is used to order the hosts within each tag.
+        hostIds = dict()
+        cursor.execute('''
+                SELECT
+                    HostID,
+                    Hostname,
+                    CommissionDate,
+                    DecommissionDate,
+                    Description,
+                    Variables
+                FROM Host
+                WHERE DecommissionDate IS NULL''' + where + '''
+                ORDER BY Hostname ASC''', params)
+        for row in cursor:
+            hostIds[row[0]] = len(self._hosts)
+            self._hostIndex[row[1]] = len(self._hosts)
+            self._hosts.append(_SnapshotHost(*row))
+
+        # Load all the tags along with their variables. The order of this list
+        # is used to order the groups as well as the tags within each host.
+        # If the snapshot is limited, only the tags of the hosts in it and the
+        # all tag are loaded.
+        tagIds = dict()
+        stmt = '''
+                SELECT
+                    TagID,
+                    TagName,
+                    TagGroup,
+                    Description,
+                    Variables
+                FROM Tag'''
+        if limit != None:
+            stmt += '''
+                WHERE
+                    TagName = 'all' OR
+                    TagID IN (
+                        SELECT HostHasTag.TagID
+                        FROM HostHasTag
+                        INNER JOIN Host
+                            ON Host.HostID = HostHasTag.HostID
+                        WHERE Host.DecommissionDate IS NULL''' + where + ''')'''
+        stmt += '''
+                ORDER BY TagGroup ASC, TagName ASC'''
+        cursor.execute(stmt, params)
+        for row in cursor:
+            tagIds[row[0]] = len(self._tags)
+            self._tagIndex[row[1]] = len(self._tags)
+            self._tags.append(_SnapshotTag(*row))
+
+        # Load the tag assignments of all the commissioned hosts
+        cursor.execute('''
+                SELECT
+                    HostHasTag.HostID,
+                    HostHasTag.TagID
+                FROM HostHasTag
+                INNER JOIN Host
+                    ON Host.HostID = HostHasTag.HostID
+                WHERE DecommissionDate IS NULL''' + where, params)
+        for (hostId, tagId) in cursor:
+            h = hostIds[hostId]
+            t = tagIds[tagId]
+            self._hosts[h].tags.append(t)
+            self._tags[t].hosts.append(h)
         cursor.close()
 
+        # Put the adjacency lists in the same order as the host and tag lists
+        for host in self._hosts:
+            host.tags.sort()
+        for tag in self._tags:
+            tag.hosts.sort()
+
+    # Gets the generation of the database the snapshot was loaded at. See
+    # Isidore.getGeneration().
+    # @return   The generation
+    def getGeneration(self):
+        return self._generation
+
+    # Gets the variables a host ends up with in Ansible. See
+    # Host.getEffectiveVars(). The merged variables of the tags are computed
+    # once for each distinct set of tags and shared by all the hosts with that
+    # set, so computing this for every host only merges each tag's variables
+    # a few times rather than once per host. Nested values may therefore be
+    # shared between the dictionaries returned for different hosts.
+    # @param hostname   The hostname of the host
+    # @return           A dictionary containing the effective variables, or
+    #                   None if the host is not in the snapshot.
+    def getEffectiveVars(self, hostname):
+        if hostname not in self._hostIndex:
+            return None
+        host = self._hosts[self._hostIndex[hostname]]
+
+        key = tuple(host.tags)
+        if key not in self._tagLayers:
+            tags = [ self._tags[self._tagIndex[name]] for name in
+                    _appliedTags([ self._tags[t].name for t in host.tags ])
+                    if name in self._tagIndex ]
+            self._tagLayers[key] = _mergeTagVars(
+                    (tag.name, self._tagVars(tag)) for tag in tags )
+
+        effective = dict(self._tagLayers[key])
+        effective.update(self._hostVars(host))
+        return effective
+
+    # Gets the hostnames of all the commissioned hosts in the snapshot
+    # @return   A list of hostnames sorted by hostname
+    def getHostnames(self):
+        return [ host.hostname for host in self._hosts ]
+
+    # Gets the variables of a host as they appear in the inventory, including
+    # the isidore variable that Host.getDetails() adds.
+    # @param hostname   The hostname of the host
+    # @return           A dictionary containing the variables, or None if
+    #                   the host is not in the snapshot.
+    def getHostVars(self, hostname):
+        if hostname not in self._hostIndex:
+            return None
+        return self._hostVars(self._hosts[self._hostIndex[hostname]])
+
+    # Gets the names of all the tags in the snapshot
+    # @return   A list of tag names sorted by group and then by name
+    def getTagNames(self):
+        return [ tag.name for tag in self._tags ]
+
+    # Gets the hostnames of all the commissioned hosts assigned to a tag
+    # @param name       The name of the tag
+    # @return           A list of hostnames, or None if the tag is not in
+    #                   the snapshot.
+    def getTagHosts(self, name):
+        if name not in self._tagIndex:
+            return None
+        return [ self._hosts[h].hostname
+                for h in self._tags[self._tagIndex[name]].hosts ]
+
+    # Gets the variables of a tag as they appear in the inventory, including
+    # the isidore_tag_<name> variable that Tag.getDetails() adds.
+    # @param name       The name of the tag
+    # @return           A dictionary containing the variables, or None if
+    #                   the tag is not in the snapshot.
+    def getTagVars(self, name):
+        if name not in self._tagIndex:
+            return None
+        return self._tagVars(self._tags[self._tagIndex[name]])
+
+    # Builds an Ansible inventory in a dictionary representation. See
+    # Isidore.getInventory().
+    # @return       the Ansible inventory dictionary representation
+    def getInventory(self):
+        inv = dict()
+
+        # Add all the hosts without a group header to ensure every
+        # system is included, even those without any tags.
+        inv['all'] = {
+                'hosts': list()
+        }
+        for host in self._hosts:
+            inv['all']['hosts'].append(
+                    { host.hostname: { 'vars': self._hostVars(host) } })
+
+        # Add each tag and its hosts as a group
+        for tag in self._tags:
+            inv[tag.name] = {
+                    'vars': self._tagVars(tag),
+                    'hosts': self._tagHostnames(tag)
+            }
+
+        return inv
+
+    # Builds an Ansible INI inventory. See Isidore.getInventoryIni().
+    # @return       the Ansible inventory INI representation as a string
+    def getInventoryIni(self):
+        out = io.StringIO()
+        self.writeInventoryIni(out)
+        return out.getvalue()
+
+    # Builds an Ansible inventory in JSON format. See
+    # Isidore.getInventoryJson().
+    # @return       the Ansible JSON inventory as a string
+    def getInventoryJson(self):
+        inv = dict()
+
+        # Add meta section
+        inv['_meta'] = {
+                'hostvars': {}
+        }
+
+        # Add all the hosts without a group header to ensure every
+        # system is included, even those without any tags.
+        inv['all'] = {
+                'hosts': list()
+        }
+        for host in self._hosts:
+            inv['all']['hosts'].append(host.hostname)
+            inv['_meta']['hostvars'][host.hostname] = self._hostVars(host)
+
+        # Add each tag and its hosts as a group
+        for tag in self._tags:
+            inv[tag.name] = {
+                    'vars': self._tagVars(tag),
+                    'hosts': self._tagHostnames(tag)
+            }
+
+        return json.dumps(inv)
+
+    # Builds an Ansible inventory in YAML format. See
+    # Isidore.getInventoryYaml().
+    # @return       the Ansible YAML inventory as a string
+    def getInventoryYaml(self):
+        out = io.StringIO()
+        self.writeInventoryYaml(out)
+        return out.getvalue()
+
+    # Saves the snapshot to a file in binary format. See writeBinary(). The
+    # new file is written under a temporary name and then renamed over the
+    # old one, so programs that have the old file open keep seeing the old
+    # snapshot and nobody ever sees a partially written file.
+    # @param path       The path of the file to save the snapshot to
+    def saveBinary(self, path):
+        directory = os.path.dirname(os.path.abspath(path))
+        (fd, tmp) = tempfile.mkstemp(dir=directory, prefix='.snapshot.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.writeBinary(f)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+
+    # Writes the snapshot to a binary file object in a format that can be
+    # loaded with BinarySnapshot. The file holds the variables of every host
+    # and tag as they appear in the inventory, the tag assignments in both
+    # directions, and the names, with the hosts and tags sorted by name so
+    # they can be looked up by binary search without reading the whole file.
+    #
+    # All integers are little endian. The file is laid out as follows:
+    # - The header (see BinarySnapshot._header)
+    # - One host record for each host (see BinarySnapshot._record)
+    # - One tag record for each tag
+    # - The tags of each host as a uint32 array of tag record numbers
+    # - The hosts of each tag as a uint32 array of host record numbers
+    # - The data: the UTF-8 names and the JSON variables that the records
+    #   point to
+    # @param out        The binary file object to write the snapshot to
+    def writeBinary(self, out):
+        # Sort the hosts and the tags by name. These are the record numbers.
+        hosts = sorted(range(len(self._hosts)),
+                key=lambda h: self._hosts[h].hostname.encode())
+        tags = sorted(range(len(self._tags)),
+                key=lambda t: self._tags[t].name.encode())
+        hostRecords = [ 0 ] * len(hosts)
+        tagRecords = [ 0 ] * len(tags)
+        for (i, h) in enumerate(hosts):
+            hostRecords[h] = i
+        for (i, t) in enumerate(tags):
+            tagRecords[t] = i
+
+        # The membership arrays
+        hostTags = list()
+        tagHosts = list()
+        hostSpans = list()
+        tagSpans = list()
+        for h in hosts:
+            members = sorted( tagRecords[t] for t in self._hosts[h].tags )
+            hostSpans.append( (len(hostTags), len(members)) )
+            hostTags.extend(members)
+        for t in tags:
+            members = sorted( hostRecords[h] for h in self._tags[t].hosts )
+            tagSpans.append( (len(tagHosts), len(members)) )
+            tagHosts.extend(members)
+
+        # Work out where each section goes
+        header = BinarySnapshot._header
+        record = BinarySnapshot._record
+        hostsOffset = header.size
+        tagsOffset = hostsOffset + record.size * len(hosts)
+        hostTagsOffset = tagsOffset + record.size * len(tags)
+        tagHostsOffset = hostTagsOffset + 4 * len(hostTags)
+        dataOffset = tagHostsOffset + 4 * len(tagHosts)
+
+        # Lay out the data, building the records along the way
+        data = list()
+        size = dataOffset
+        def put(blob):
+            nonlocal size
+            data.append(blob)
+            size += len(blob)
+            return (size - len(blob), len(blob))
+
+        records = list()
+        for (h, (start, count)) in zip(hosts, hostSpans):
+            host = self._hosts[h]
+            name = put(host.hostname.encode())
+            hostvars = put(json.dumps(self._hostVars(host)).encode())
+            records.append(record.pack(*name, *hostvars, start, count))
+        for (t, (start, count)) in zip(tags, tagSpans):
+            tag = self._tags[t]
+            name = put(tag.name.encode())
+            tagvars = put(json.dumps(self._tagVars(tag)).encode())
+            records.append(record.pack(*name, *tagvars, start, count))
+
+        out.write(header.pack(BinarySnapshot._magic, BinarySnapshot._version,
+                len(hosts), len(tags), self._generation, hostsOffset,
+                tagsOffset, hostTagsOffset, tagHostsOffset, dataOffset))
+        out.write(b''.join(records))
+        out.write(struct.pack('<%dI' % len(hostTags), *hostTags))
+        out.write(struct.pack('<%dI' % len(tagHosts), *tagHosts))
+        out.write(b''.join(data))
+
+    # Writes the Ansible INI inventory to a file object. See
+    # Isidore.writeInventoryIni().
+    # @param out        The file object to write the inventory to
+    def writeInventoryIni(self, out):
+        _writeInventoryIni(out,
+                ( host.hostname for host in self._hosts ),
+                ( (tag.name, tag.group, tag.description,
+                    self._tagHostnames(tag)) for tag in self._tags ))
+
+    # Writes the Ansible inventory in YAML format to a file object. See
+    # Isidore.writeInventoryYaml().
+    # @param out        The file object to write the inventory to
+    def writeInventoryYaml(self, out):
+        # Any variables assigned to the 'all' tag require special treatment
+        # since it goes at the top of the YAML tree unlike all the other tags.
+        tag_all = self.getTagVars('all')
+
+        # The hosts and the tags, as well as the hosts of each tag, are
+        # written sorted by name, the same way yaml.dump() sorts mapping keys.
+        # The snapshot keeps them in the collation order of the database,
+        # which differs for names with mixed case or punctuation.
+        hosts = sorted(self._hosts, key=lambda host: host.hostname)
+        tags = sorted(self._tags, key=lambda tag: tag.name)
+
+        _writeInventoryYaml(out,
+                dict() if tag_all == None else tag_all,
+                ( (tag.name, self._tagVars(tag),
+                        sorted(self._tagHostnames(tag)))
+                    for tag in tags if tag.name != 'all' ),
+                ( (host.hostname, self._hostVars(host)) for host in hosts ))
+
+    # Builds the variables for a host the same way Host.getDetails() does
+    # @param host       The _SnapshotHost
+    # @return           A new dictionary containing the variables
+    def _hostVars(self, host):
+        return _buildHostVars(host.variables, host.commissionDate,
+                host.decommissionDate, host.description,
+                ( (self._tags[t].name, self._tags[t].group)
+                    for t in host.tags ))
+
+    # Gets the hostnames of the hosts assigned to a tag
+    # @param tag        The _SnapshotTag
+    # @return           A list of hostnames
+    def _tagHostnames(self, tag):
+        return [ self._hosts[h].hostname for h in tag.hosts ]
+
+    # Builds the variables for a tag the same way Tag.getDetails() does
+    # @param tag        The _SnapshotTag
+    # @return           A new dictionary containing the variables
+    def _tagVars(self, tag):
+        return _buildTagVars(tag.name, tag.group, tag.description,
+                tag.variables)
+
+# A snapshot saved with InventorySnapshot.saveBinary(). The file is memory
+# mapped rather than read, and hosts and tags are found by binary search over
+# the records, so opening it takes the same time no matter how large it is and
+# each lookup only touches the pages it needs. Only the variables that are
+# asked for are decoded.
+class BinarySnapshot:
+
+    _magic = b'ISIDSNAP'
+    _version = 1
+
+    # magic, version, host count, tag count, generation, and the offsets of
+    # the host records, tag records, host tags, tag hosts, and data
+    _header = struct.Struct('<8sIIIQQQQQQ')
+
+    # name offset, name length, variables offset, variables length, and the
+    # start and length of the membership array
+    _record = struct.Struct('<QIQIII')
+
+    _file = None
+    _map = None
+    _hostCount = None
+    _tagCount = None
+    _generation = None
+    _hostsOffset = None
+    _tagsOffset = None
+    _hostTagsOffset = None
+    _tagHostsOffset = None
+
+    # Opens a binary snapshot
+    # @param path       The path of the file to open
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                    access=mmap.ACCESS_READ)
+        except:
+            self._file.close()
+            raise
+
+        if len(self._map) < self._header.size:
+            self.close()
+            raise ValueError(path+' is not an Isidore snapshot')
+        (magic, version, self._hostCount, self._tagCount, self._generation,
+                self._hostsOffset, self._tagsOffset, self._hostTagsOffset,
+                self._tagHostsOffset, dataOffset) = \
+                self._header.unpack_from(self._map, 0)
+        if magic != self._magic:
+            self.close()
+            raise ValueError(path+' is not an Isidore snapshot')
+        if version != self._version:
+            self.close()
+            raise ValueError(path+' is an unsupported snapshot version')
+
+    # Closes the snapshot. It should not be used after this method is called.
+    def close(self):
+        if self._map != None:
+            self._map.close()
+            self._map = None
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+    # Gets the generation of the database the snapshot was taken at. See
+    # Isidore.getGeneration().
+    # @return   The generation
+    def getGeneration(self):
+        return self._generation
+
+    # Gets the hostnames of all the hosts in the snapshot
+    # @return   A list of hostnames sorted by hostname
+    def getHostnames(self):
+        return [ self._name(self._hostsOffset, i)
+                for i in range(self._hostCount) ]
+
+    # Gets the names of the tags assigned to a host
+    # @param hostname   The hostname of the host
+    # @return           A list of tag names sorted by name, or None if the host
+    #                   is not in the snapshot.
+    def getHostTags(self, hostname):
+        i = self._find(self._hostsOffset, self._hostCount, hostname)
+        if i == None:
+            return None
+        return [ self._name(self._tagsOffset, t) for t in
+                self._members(self._hostsOffset, self._hostTagsOffset, i) ]
+
+    # Gets the variables of a host as they appear in the inventory. See
+    # InventorySnapshot.getHostVars().
+    # @param hostname   The hostname of the host
+    # @return           A dictionary containing the variables, or None if the
+    #                   host is not in the snapshot.
+    def getHostVars(self, hostname):
+        i = self._find(self._hostsOffset, self._hostCount, hostname)
+        if i == None:
+            return None
+        return self._vars(self._hostsOffset, i)
+
+    # Gets the names of all the tags in the snapshot
+    # @return   A list of tag names sorted by name
+    def getTagNames(self):
+        return [ self._name(self._tagsOffset, i)
+                for i in range(self._tagCount) ]
+
+    # Gets the hostnames of the hosts assigned to a tag
+    # @param name       The name of the tag
+    # @return           A list of hostnames sorted by hostname, or None if the
+    #                   tag is not in the snapshot.
+    def getTagHosts(self, name):
+        i = self._find(self._tagsOffset, self._tagCount, name)
+        if i == None:
+            return None
+        return [ self._name(self._hostsOffset, h) for h in
+                self._members(self._tagsOffset, self._tagHostsOffset, i) ]
+
+    # Gets the variables of a tag as they appear in the inventory. See
+    # InventorySnapshot.getTagVars().
+    # @param name       The name of the tag
+    # @return           A dictionary containing the variables, or None if the
+    #                   tag is not in the snapshot.
+    def getTagVars(self, name):
+        i = self._find(self._tagsOffset, self._tagCount, name)
+        if i == None:
+            return None
+        return self._vars(self._tagsOffset, i)
+
+    # Finds a record by name using binary search
+    # @param offset     The offset of the records to search
+    # @param count      The number of records
+    # @param name       The name to search for
+    # @return           The record number, or None if there is no record with
+    #                   that name
+    def _find(self, offset, count, name):
+        key = name.encode()
+        lo = 0
+        hi = count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            (nameOffset, nameLength) = struct.unpack_from('<QI', self._map,
+                    offset + mid * self._record.size)
+            found = self._map[nameOffset:nameOffset+nameLength]
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    # Gets the record numbers in the membership array of a record
+    # @param offset         The offset of the records
+    # @param arrayOffset    The offset of the membership arrays
+    # @param i              The record number
+    # @return               A tuple of record numbers
+    def _members(self, offset, arrayOffset, i):
+        (start, count) = struct.unpack_from('<II', self._map,
+                offset + i * self._record.size + 24)
+        return struct.unpack_from('<%dI' % count, self._map,
+                arrayOffset + 4 * start)
+
+    # Gets the name of a record
+    # @param offset     The offset of the records
+    # @param i          The record number
+    # @return           The name
+    def _name(self, offset, i):
+        (nameOffset, nameLength) = struct.unpack_from('<QI', self._map,
+                offset + i * self._record.size)
+        return self._map[nameOffset:nameOffset+nameLength].decode()
+
+    # Decodes the variables of a record
+    # @param offset     The offset of the records
+    # @param i          The record number
+    # @return           A new dictionary containing the variables
+    def _vars(self, offset, i):
+        (varsOffset, varsLength) = struct.unpack_from('<QI', self._map,
+                offset + i * self._record.size + 12)
+        return json.loads(self._map[varsOffset:varsOffset+varsLength])
+
+# Selects commissioned hosts by boolean expressions over their tags, such as
+# "server and newark and not virtual". The tag assignments are loaded once into
+# a bitmap for each tag, stored as a Python integer with one bit for each host,
+# so evaluating an expression is a handful of integer operations no matter how
+# many hosts there are.
+#
+# Expressions are made of tag names, the operators and, or and not (or &, |
+# and !), and parentheses. not binds tightest and or binds loosest. Tag names
+# can be quoted with single or double quotes, and the special tag all always
+# matches every commissioned host.
+class HostSelector:
+
+    _hostnames = None
+    _bitmaps = None
+    _all = None
+
+    # Loads a new host selector from the database
+    # @param isidore    The Isidore object to load the tag assignments from
+    def __init__(self, isidore):
+        self._hostnames = list()
+        self._bitmaps = dict()
+        cursor = isidore._conn.cursor()
+
+        # Number the commissioned hosts in order of hostname. These are the
+        # bit positions.
+        hostIds = dict()
+        cursor.execute('''
+                SELECT HostID, Hostname
+                FROM Host
+                WHERE DecommissionDate IS NULL
+                ORDER BY Hostname ASC''')
+        for (hostId, hostname) in cursor:
+            hostIds[hostId] = len(self._hostnames)
+            self._hostnames.append(hostname)
+
+        # Every tag gets a bitmap, even those without any hosts
+        cursor.execute('SELECT TagID, TagName FROM Tag')
+        tagNames = dict(cursor.fetchall())
+        bitmaps = dict()
+        size = (len(self._hostnames) + 7) // 8
+        for tagId in tagNames:
+            bitmaps[tagId] = bytearray(size)
+
+        cursor.execute('SELECT HostID, TagID FROM HostHasTag')
+        for (hostId, tagId) in cursor:
+            if hostId in hostIds:
+                h = hostIds[hostId]
+                bitmaps[tagId][h >> 3] |= 1 << (h & 7)
+        cursor.close()
+
+        for (tagId, bitmap) in bitmaps.items():
+            self._bitmaps[tagNames[tagId]] = int.from_bytes(bitmap, 'little')
+        self._all = (1 << len(self._hostnames)) - 1
+
+    # Counts the hosts matching a tag expression
+    # @param expression The tag expression
+    # @return           The number of matching hosts
+    # @throws ValueError    If the expression is invalid or refers to a tag
+    #                       that does not exist
+    def count(self, expression):
+        return bin(self._evaluate(_parseTagExpression(expression))).count('1')
+
+    # Selects the hosts matching a tag expression
+    # @param expression The tag expression
+    # @return           A list of the hostnames of the matching hosts, sorted
+    #                   by hostname
+    # @throws ValueError    If the expression is invalid or refers to a tag
+    #                       that does not exist
+    def select(self, expression):
+        bits = format(self._evaluate(_parseTagExpression(expression)), 'b')
+
+        # The binary string has the highest host first, so positions are
+        # counted from the end
+        hostnames = list()
+        last = len(bits) - 1
+        i = bits.rfind('1')
+        while i != -1:
+            hostnames.append(self._hostnames[last - i])
+            i = bits.rfind('1', 0, i)
+        return hostnames
+
+    # Evaluates a parsed tag expression
+    # @param node       The parsed expression. See _parseTagExpression().
+    # @return           The bitmap of the matching hosts
+    def _evaluate(self, node):
+        if node[0] == 'tag':
+            if node[1] == 'all':
+                return self._all
+            if node[1] not in self._bitmaps:
+                raise ValueError('Tag '+node[1]+' does not exist')
+            return self._bitmaps[node[1]]
+        elif node[0] == 'not':
+            return self._all & ~self._evaluate(node[1])
+        elif node[0] == 'and':
+            return self._evaluate(node[1]) & self._evaluate(node[2])
+        else:
+            return self._evaluate(node[1]) | self._evaluate(node[2])
+
+# The tokens of a tag expression: parentheses, operators, quoted tag names, and
+# unquoted tag names
+_tagExpressionToken = re.compile(
+        r'''\s*(?:([()&|!])|"([^"]*)"|'([^']*)'|([^\s()&|!"']+))''')
+
+# Parses a tag expression. See HostSelector.
+# @param expression The tag expression
+# @return           The parsed expression as nested tuples: ('tag', name),
+#                   ('not', node), ('and', node, node), or ('or', node, node)
+# @throws ValueError    If the expression is invalid
+def _parseTagExpression(expression):
+    # Split the expression into (operator, name) tuples. Exactly one of the
+    # two is set in each.
+    tokens = list()
+    pos = 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        match = _tagExpressionToken.match(expression, pos)
+        if match == None:
+            raise ValueError('Unterminated quote in tag expression')
+        (symbol, double, single, word) = match.groups()
+        if symbol != None:
+            tokens.append( ({ '&': 'and', '|': 'or', '!': 'not' }.get(
+                    symbol, symbol), None) )
+        elif word != None and word.lower() in [ 'and', 'or', 'not' ]:
+            tokens.append( (word.lower(), None) )
+        elif word != None:
+            tokens.append( (None, word) )
+        else:
+            tokens.append( (None, double if double != None else single) )
+        pos = match.end()
+    tokens.append( ('end', None) )
+    pos = 0
+
+    def peek():
+        return tokens[pos][0]
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos-1]
+
+    # expression := term ('or' term)*
+    def parseOr():
+        node = parseAnd()
+        while peek() == 'or':
+            take()
+            node = ('or', node, parseAnd())
+        return node
+
+    # term := factor ('and' factor)*
+    def parseAnd():
+        node = parseNot()
+        while peek() == 'and':
+            take()
+            node = ('and', node, parseNot())
+        return node
+
+    # factor := 'not' factor | '(' expression ')' | tag
+    def parseNot():
+        (op, name) = take()
+        if op == 'not':
+            return ('not', parseNot())
+        elif op == '(':
+            node = parseOr()
+            if take()[0] != ')':
+                raise ValueError('Missing ) in tag expression')
+            return node
+        elif op == None:
+            return ('tag', name)
+        elif op == 'end':
+            raise ValueError('Unexpected end of tag expression')
+        else:
+            raise ValueError('Unexpected '+op+' in tag expression')
+
+    node = parseOr()
+    if peek() != 'end':
+        raise ValueError('Unexpected '+str(tokens[pos][0] or tokens[pos][1])+
+                ' in tag expression')
+    return node
+
+# Builds the variables for a host the same way Host.getDetails() does
+# @param variables          The JSON string of the host's variables
+# @param commissionDate     The host's commission date
+# @param decommissionDate   The host's decommission date
+# @param description        The host's description
+# @param tags               An iterable of (name, group) tuples of the tags
+#                           assigned to the host, sorted by group and then by
+#                           name
+# @return                   A new dictionary containing the variables
+def _buildHostVars(variables, commissionDate, decommissionDate, description,
+        tags):
+    hostvars = json.loads(variables)
+    isivar = {}
+
+    # Host Attributes
+    isivar['commissioned'] = str(commissionDate) \
+            if commissionDate is not None else None
+    isivar['decommissioned'] = str(decommissionDate) \
+            if decommissionDate is not None else None
+    isivar['description'] = description
+
+    # Tags
+    isivar['tags'] = {}
+    for (name, group) in tags:
+        if group is None:
+            group = 'ungrouped'
+
+        if group not in isivar['tags']:
+            isivar['tags'][group] = list()
+
+        isivar['tags'][group].append(name)
+
+    hostvars['isidore'] = isivar
+    return hostvars
+
+# Builds the variables for a tag the same way Tag.getDetails() does
+# @param name           The name of the tag
+# @param group          The group of the tag
+# @param description    The description of the tag
+# @param variables      The JSON string of the tag's variables
+# @return               A new dictionary containing the variables
+def _buildTagVars(name, group, description, variables):
+    tagvars = json.loads(variables)
+    tagvars['isidore_tag_'+name] = {
+            'description': description,
+            'group': group
+    }
+    return tagvars
+
+# Gets the tags Ansible applies to a host. Every host is in the all group.
+# Ansible puts a host that is in no other group in the ungrouped group, and
+# takes any other host out of it, even if it is listed in it.
+# @param names      The names of the tags assigned to the host
+# @return           A list of the names of the tags that apply to the host
+def _appliedTags(names):
+    applied = [ name for name in names if name not in [ 'all', 'ungrouped' ] ]
+    if applied == []:
+        applied.append('ungrouped')
+    applied.append('all')
+    return applied
+
+# Merges the variables of tags in the order Ansible applies groups to a host:
+# the all group first, then the other groups by ansible_group_priority and then
+# by name. Later groups override earlier ones one variable at a time.
+# @param layers     An iterable of (name, variables) tuples, one for each tag
+# @return           A new dictionary containing the merged variables
+def _mergeTagVars(layers):
+    def order(layer):
+        (name, tagvars) = layer
+        try:
+            priority = int(tagvars.get('ansible_group_priority', 1))
+        except (TypeError, ValueError):
+            priority = 1
+        return (name != 'all', priority, name)
+
+    merged = dict()
+    for (name, tagvars) in sorted(layers, key=order):
+        merged.update(tagvars)
+
+    # Ansible treats this as a property of the group rather than a variable
+    merged.pop('ansible_group_priority', None)
+    return merged
+
+# Splits a list into chunks that are small enough to be sent to the database
+# in a single statement
+# @param items      The list to split
+# @param size=1000  The maximum number of items in each chunk
+# @return           A generator of lists
+def _chunks(items, size=1000):
+    for i in range(0, len(items), size):
+        yield items[i:i+size]
+
+# Builds the placeholders for an IN (...) list
+# @param items      The items that will be substituted for the placeholders
+# @return           A string of comma separated placeholders
+def _placeholders(items):
+    return ', '.join( [ '%s' ] * len(items) )
+
+# Converts a shell-style pattern with * and ? into a LIKE pattern that uses !
+# as its escape character
+# @param pattern    The shell-style pattern
+# @return           The LIKE pattern
+def _likePattern(pattern):
+    return pattern.replace('!', '!!').replace('%', '!%') \
+            .replace('_', '!_').replace('*', '%').replace('?', '_')
+
+# The host variable paths that can be indexed: names and array indexes
+_indexablePath = re.compile(r'\$(\.[A-Za-z_][A-Za-z0-9_]*|\[[0-9]+\])+')
+
+# Turns an Ansible style host pattern into an SQL condition on the Host table.
+# See Isidore.getInventorySnapshot().
+# @param limit      The host pattern, or None
+# @return           A (condition, parameters) tuple. The condition starts with
+#                   AND so it can be appended to a WHERE clause, and is empty
+#                   if limit is None.
+# @throws ValueError    If the pattern is invalid
+def _limitCondition(limit):
+    if limit == None:
+        return ('', [])
+
+    # Matches a host by hostname or by the name of one of its tags. LIKE is
+    # given an explicit escape character since the default differs between
+    # databases. Host patterns are case sensitive in Ansible, so the pattern
+    # is compared as a binary string instead of with the case insensitive
+    # collation of the columns.
+    def match(pattern):
+        if pattern in [ 'all', '*' ]:
+            return ('1 = 1', [])
+        like = _likePattern(pattern)
+        return ('''(Host.Hostname LIKE CAST(%s AS BINARY) ESCAPE '!' OR
+                    EXISTS (
+                        SELECT 1
+                        FROM HostHasTag AS LimitHasTag
+                        INNER JOIN Tag AS LimitTag
+                            ON LimitTag.TagID = LimitHasTag.TagID
+                        WHERE
+                            LimitHasTag.HostID = Host.HostID AND
+                            LimitTag.TagName LIKE CAST(%s AS BINARY)
+                                ESCAPE '!'))''',
+                [ like, like ])
+
+    include = list()
+    intersect = list()
+    exclude = list()
+    for item in re.split('[,:]', limit):
+        item = item.strip()
+        if item == '':
+            continue
+        elif item[0] == '~':
+            raise ValueError('Regular expression host patterns are not supported')
+        elif item[0] == '&':
+            intersect.append(match(item[1:]))
+        elif item[0] == '!':
+            exclude.append(match(item[1:]))
+        else:
+            include.append(match(item))
+
+    # A pattern with only & and ! parts starts from every host
+    if include == []:
+        include.append(match('all'))
+
+    where = '''
+                    AND (''' + ' OR '.join( [ c for (c, p) in include ] ) + ')'
+    params = list()
+    for (c, p) in include:
+        params.extend(p)
+    for (c, p) in intersect:
+        where += '''
+                    AND ''' + c
+        params.extend(p)
+    for (c, p) in exclude:
+        where += '''
+                    AND NOT ''' + c
+        params.extend(p)
+    return (where, params)
+
+# Writes an Ansible INI inventory to a file object one line at a time.
+# @param out        The file object to write the inventory to
+# @param hostnames  An iterable of the hostnames to list without a group
+#                   header
+# @param tags       An iterable of (name, group, description, hostnames)
+#                   tuples, one for each group
+def _writeInventoryIni(out, hostnames, tags):
+    # Add all the hosts without a group header to ensure every
+    # system is included, even those without any tags.
+    out.write("# All Host\n")
+    for hostname in hostnames:
+        out.write(hostname + "\n")
+    out.write("\n")
+
+    # Print each tag and its hosts as a group
+    for (name, group, description, hostnames) in tags:
+        # Comment
+        if group == None:
+            out.write("# "+name+" ("+str(description)+")\n")
+        else:
+            out.write("# "+group+": "+name+" ("+str(description)+")\n")
+
+        # Header
+        out.write("["+name+"]\n")
+
+        # Hosts
+        for hostname in hostnames:
+            out.write(hostname + "\n")
+        out.write("\n")
+
+# A file on local disk holding a copy of the JSON inventory. Each time the
+# inventory is requested, the generation of the database is read and compared
+# with the one stored in the file. The file is served without running any
+# inventory queries if they match, and regenerated if they do not.
+class InventoryCache:
+
+    _isidore = None
+    _path = None
+
+    # Creates a new InventoryCache object
+    # @param isidore    The Isidore object to generate the inventory from
+    # @param path       The path of the cache file
+    def __init__(self, isidore, path):
+        self._isidore = isidore
+        self._path = path
+
+    # Gets the path of the cache file
+    # @return   The path
+    def getPath(self):
+        return self._path
+
+    # Writes the JSON inventory to a file object, either from the cache file if
+    # it is up to date or by regenerating the cache file first. The output is
+    # identical to Isidore.getInventoryJson().
+    # @param out        The file object to write the inventory to
+    def writeInventoryJson(self, out):
+        # The generation is read in the same transaction as the inventory, so
+        # the two are always consistent with each other.
+        generation = str(self._isidore.getGeneration())
+
+        # Serve the cached copy if nothing has changed since it was written.
+        # The first line of the file holds the generation it was written at.
+        try:
+            with open(self._path, 'r') as f:
+                if f.readline() == generation + '\n':
+                    shutil.copyfileobj(f, out)
+                    return
+        except OSError:
+            pass
+
+        # Regenerate the cache. The new file is written under a temporary name
+        # and then renamed over the old one so that readers never see a
+        # partially written file. It is made readable by everyone since the
+        # cache is usually shared with other users, such as the one running
+        # Ansible. If the cache cannot be written, for instance because its
+        # directory is missing or not writable, the inventory is written
+        # straight from the database instead.
+        directory = os.path.dirname(os.path.abspath(self._path))
+        try:
+            (fd, tmp) = tempfile.mkstemp(dir=directory, prefix='.inventory.')
+        except OSError:
+            self._isidore.writeInventoryJson(out)
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(generation + '\n')
+                self._isidore.writeInventoryJson(f)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, self._path)
+        except OSError:
+            os.unlink(tmp)
+            self._isidore.writeInventoryJson(out)
+            return
+        except:
+            os.unlink(tmp)
+            raise
+
+        with open(self._path, 'r') as f:
+            f.readline()
+            shutil.copyfileobj(f, out)
+
+# Creates the YAML dumper used for the inventory. It never emits anchors or
+# aliases, so repeated values are written out in full. The libyaml based dumper
+# is used if PyYAML was built with it since it is much faster than the pure
+# Python one. The class is defined here rather than at the top level so that
+# PyYAML is not loaded until an inventory is written.
+# @param out        The file object to write to
+# @return           The dumper
+def _inventoryDumper(out):
+
+    class InventoryDumper(getattr(yaml, 'CSafeDumper', yaml.SafeDumper)):
+
+        def ignore_aliases(self, data):
+            return True
+
+    return InventoryDumper(out, default_flow_style=False)
+
+# Writes an Ansible inventory in YAML format to a file object one host and one
+# tag at a time. The output is the same as that of yaml.dump() with
+# default_flow_style=False, so the tags and the hosts must be given sorted by
+# name.
+# @param out        The file object to write the inventory to
+# @param allVars    The variables of the all group
+# @param children   An iterable of (name, vars, hostnames) tuples, one for
+#                   each group
+# @param hosts      An iterable of (hostname, vars) tuples, one for each host
+def _writeInventoryYaml(out, allVars, children, hosts):
+    dumper = _inventoryDumper(out)
+
+    # Emits a value the same way the serializer would as part of a document
+    def emit(data):
+        stack = [ dumper.represent_data(data) ]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, yaml.events.Event):
+                dumper.emit(node)
+            elif isinstance(node, yaml.ScalarNode):
+                implicit = (
+                        node.tag == dumper.resolve(yaml.ScalarNode, node.value,
+                            (True, False)),
+                        node.tag == dumper.resolve(yaml.ScalarNode, node.value,
+                            (False, True)) )
+                dumper.emit(yaml.ScalarEvent(None, node.tag, implicit,
+                    node.value, style=node.style))
+            elif isinstance(node, yaml.SequenceNode):
+                implicit = node.tag == dumper.resolve(yaml.SequenceNode,
+                        node.value, True)
+                dumper.emit(yaml.SequenceStartEvent(None, node.tag, implicit,
+                    flow_style=node.flow_style))
+                stack.append(yaml.SequenceEndEvent())
+                stack.extend(reversed(node.value))
+            else:
+                implicit = node.tag == dumper.resolve(yaml.MappingNode,
+                        node.value, True)
+                dumper.emit(yaml.MappingStartEvent(None, node.tag, implicit,
+                    flow_style=node.flow_style))
+                stack.append(yaml.MappingEndEvent())
+                for (key, value) in reversed(node.value):
+                    stack.append(value)
+                    stack.append(key)
+
+    # Starts a block mapping whose contents will be emitted one at a time
+    def start():
+        dumper.emit(yaml.MappingStartEvent(None, None, True, flow_style=False))
+
+    def end():
+        dumper.emit(yaml.MappingEndEvent())
+
+    dumper.open()
+    dumper.emit(yaml.DocumentStartEvent(explicit=False))
+    start()
+    emit('all')
+    start()
+
+    # Groups
+    emit('children')
+    start()
+    for (name, tagvars, hostnames) in children:
+        emit(name)
+        start()
+        emit('hosts')
+        start()
+        for hostname in hostnames:
+            emit(hostname)
+            emit({})
+        end()
+        emit('vars')
+        emit(tagvars)
+        end()
+    end()
+
+    # Hosts
+    emit('hosts')
+    start()
+    for (hostname, hostvars) in hosts:
+        emit(hostname)
+        emit(hostvars)
+    end()
+
+    # Variables of the all group
+    emit('vars')
+    emit(allVars)
+
+    end()
+    end()
+    dumper.emit(yaml.DocumentEndEvent(explicit=False))
+    dumper.close()
+
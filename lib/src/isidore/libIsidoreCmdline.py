@@ -24,8 +24,17 @@ import shlex
 import sys
 import traceback
 import datetime
+import re
+import itertools
 
 from isidore.libIsidore import *
+from isidore.libIsidore import _LazyModule
+
+_connector = _LazyModule('mysql.connector')
+yaml = _LazyModule('yaml')
+
+# A range in a hostname, such as [001:250], [a:f], or [0:30:10]
+_hostRange = re.compile(r'\[([0-9]+|[a-zA-Z]):([0-9]+|[a-zA-Z])(?::([0-9]+))?\]')
 
 # The Isidore command prompt
 class IsidoreCmdline:
@@ -103,6 +112,129 @@ quit        exit''')
                 print(motd)
         self.subprompt([], self.rootprompt)
 
+    # Restores a dump made with show config. Replaying the dump at the prompt
+    # runs each line as its own transaction. Instead, this reads the whole
+    # dump first and loads it with Isidore.restore(), in a single
+    # transaction. Variable indexes alter the Host table, which can't be
+    # done in that transaction, so they are created after it is committed.
+    # @param lines      An iterable of the lines of the dump
+    # @return           True if the dump was restored, or False if it could
+    #                   not be. Nothing is changed then, unless only the
+    #                   variable indexes failed, in which case everything
+    #                   else in the dump has been restored.
+    def restore(self, lines):
+        now = datetime.datetime.now()
+        hosts = dict()
+        tags = dict()
+        assignments = list()
+        config = list()
+
+        def none(value):
+            return None if value == 'none' else value
+
+        def date(value):
+            return { 'none': None, 'now': now }.get(value, value)
+
+        def variables(value):
+            return json.dumps(json.loads(value))
+
+        # Checks for <kind> <name> <words...> <value>, where name is one of
+        # the hosts or tags created earlier in the dump
+        def matches(args, kind, objects, *words):
+            return len(args) == len(words) + 3 and args[0] == kind and \
+                    args[1] in objects and tuple(args[2:-1]) == words
+
+        # Collect everything the dump sets. Only the commands that show config
+        # writes are accepted.
+        pending = ''
+        for (number, line) in enumerate(lines, 1):
+            # A quoted value, such as a description, can span several lines
+            line = pending + line
+            try:
+                args = shlex.split(line)
+                pending = ''
+            except ValueError:
+                pending = line
+                continue
+
+            try:
+                if args == [] or args[0] == 'echo':
+                    continue
+                elif args[:2] == [ 'create', 'host' ] and len(args) == 3:
+                    hosts[args[2]] = [ now, None, None, '{}' ]
+                elif args[:2] == [ 'create', 'tag' ] and len(args) == 3:
+                    tags[args[2]] = [ None, None, '{}' ]
+                elif args[:2] == [ 'config', 'set' ] and (len(args) == 4 and
+                        args[2] in [ 'materialized', 'motd', 'name' ] or
+                        len(args) == 5 and args[2] == 'index'):
+                    config.append(args[2:])
+                elif matches(args, 'host', hosts, 'set', 'commissioned'):
+                    hosts[args[1]][0] = date(args[4])
+                elif matches(args, 'host', hosts, 'set', 'decommissioned'):
+                    hosts[args[1]][1] = date(args[4])
+                elif matches(args, 'host', hosts, 'set', 'description'):
+                    hosts[args[1]][2] = none(args[4])
+                elif matches(args, 'host', hosts, 'var', 'set', '$'):
+                    hosts[args[1]][3] = variables(args[5])
+                elif matches(args, 'host', hosts, 'tag', 'add') and \
+                        args[4] in tags:
+                    assignments.append( (args[1], args[4]) )
+                elif matches(args, 'tag', tags, 'set', 'group'):
+                    tags[args[1]][0] = none(args[4])
+                elif matches(args, 'tag', tags, 'set', 'description'):
+                    tags[args[1]][1] = none(args[4])
+                elif matches(args, 'tag', tags, 'var', 'set', '$'):
+                    tags[args[1]][2] = variables(args[5])
+                else:
+                    print('Line %d: unsupported command: %s' %
+                            (number, line.strip()), file=sys.stderr)
+                    return False
+            except json.decoder.JSONDecodeError:
+                print('Line %d: invalid JSON' % number, file=sys.stderr)
+                return False
+        if pending != '':
+            print('Missing closing quotation at the end of the dump',
+                    file=sys.stderr)
+            return False
+
+        # Load it all at once. Indexes and the materialized inventory are
+        # built afterwards, since that is faster than keeping them up to
+        # date row by row.
+        try:
+            with self._isidore.batch():
+                for args in config:
+                    if args[0] == 'motd':
+                        self._isidore.setMotd(none(args[1]))
+                    elif args[0] == 'name':
+                        self._isidore.setName(none(args[1]))
+                self._isidore.restore(
+                        [ tuple( [ name ] + host ) for (name, host) in hosts.items() ],
+                        [ tuple( [ name ] + tag ) for (name, tag) in tags.items() ],
+                        assignments)
+                for args in config:
+                    if args[0] == 'materialized':
+                        self._isidore.setMaterialized(args[1] == 'on')
+        except:
+            print('Failed to restore the dump', file=sys.stderr)
+            print(traceback.format_exc(), file=sys.stderr)
+            return False
+
+        print('Restored %d hosts and %d tags' % (len(hosts), len(tags)))
+
+        # Everything else has been committed by now, so an index that fails
+        # leaves the rest of the dump restored
+        restored = True
+        for args in config:
+            if args[0] != 'index':
+                continue
+            try:
+                self._isidore.setVarIndex(args[1], args[2] == 'on')
+            except:
+                print('Failed to set the index on '+args[1], file=sys.stderr)
+                print(traceback.format_exc(), file=sys.stderr)
+                restored = False
+        return restored
+
     # >
     def rootprompt(self, args):
 
@@ -119,6 +251,8 @@ quit        exit''')
             self.describe(args)
         elif args[0] == 'echo':
             self.echo(args)
+        elif args[0] == 'export':
+            self.export(args)
         elif args[0] == 'help':
             print('''\
 Pst! You should really use ? to display the help message. ? will
@@ -148,6 +282,7 @@ create      create various objects (such as hosts and tags)
 delete      delete various objects (such as hosts and tags)
 describe    print details about various data
 echo        print text back to the console
+export      write data to files for use by other programs
 help        alias for ?
 host        manipulate a host
 rename      rename various objects (such as hosts and tags)
@@ -163,6 +298,7 @@ version     display Isidore version information''')
         elif args[1] == '?':
             print('''\
 ?           print this help message
+changes     print the changes made to hosts and tags
 config      print the commmands to populate the database with the current 
             configuration
 hosts       print all commissioned hosts in the database
@@ -171,11 +307,14 @@ inventory   print the full Ansible inventory file
 tag-groups  print all the tag groups in the database
 tags        print all tags in the database''')
 
+        elif args[1] == 'changes':
+            self.show_changes(args)
+
         elif args[1] == 'config':
-            self.show_config(args[1])
+            self.show_config(args)
 
         elif args[1] == 'hosts':
-            self.show_hosts(args[1])
+            self.show_hosts(args)
 
         elif args[1] == 'inventory':
             self.show_inventory(args)
@@ -192,74 +331,160 @@ tags        print all tags in the database''')
         else:
             print('Invalid argument '+args[1]+'. Enter ? for help.', file=sys.stderr)
 
+    # > show changes
+    def show_changes(self, args):
+        if len(args) == 2:
+            self.subprompt(args, self.show_changes)
+        elif args[2] == '?':
+            print('''\
+?           print this help message
+last        print the most recent changes
+since       print the changes made after a given change''')
+
+        elif args[2] in [ 'last', 'since' ]:
+            if len(args) == 3 or args[3] == '?':
+                if args[2] == 'last':
+                    print('''\
+<count>     the number of changes to print''')
+                else:
+                    print('''\
+<seq>       the number of the last change already seen, or 0 to print
+            all changes''')
+                return
+            elif len(args) > 4 and args[4] == '?':
+                print('''\
+brief       leave out the number and the time of each change
+<cr>        print the changes''')
+                return
+            elif len(args) > 5 or (len(args) == 5 and args[4] != 'brief'):
+                print('Invalid argument '+args[-1]+'. Enter ? for help.', file=sys.stderr)
+                return
+
+            try:
+                number = int(args[3])
+            except ValueError:
+                number = None
+            if args[2] == 'last' and (number == None or number < 0):
+                print('Invalid count '+args[3]+'.', file=sys.stderr)
+                return
+            elif number == None:
+                print('Invalid change number '+args[3]+'.', file=sys.stderr)
+                return
+
+            try:
+                if args[2] == 'last':
+                    changes = self._isidore.getLastChanges(number)
+                else:
+                    changes = self._isidore.getChangesSince(number)
+            except _connector.ProgrammingError as e:
+                if e.errno != 1146:
+                    raise
+                print('The change log does not exist in this database. Run db/upgrade_db.sql to create it.', file=sys.stderr)
+                return
+
+            # One change per line: the change number and the time unless
+            # brief was given, the type and name of the object, what was
+            # done, and the details if any
+            for change in changes:
+                line = '%s %s %s' % (change['type'], change['name'],
+                        change['action'])
+                if len(args) == 4:
+                    line = '%d %s %s' % (change['seq'], change['time'], line)
+                if change['detail'] is not None:
+                    line += ' ' + json.dumps(change['detail'])
+                print(line)
+
+        else:
+            print('Invalid argument '+args[2]+'. Enter ? for help.', file=sys.stderr)
+
     # > show config
-    def show_config(self, args):
-        hosts = self._isidore.getHosts()
-        tags = self._isidore.getTags()
+    def show_config(self, args, out=None):
+        # > show config > <file>
+        if '>' in args[2:]:
+            i = args.index('>', 2)
+            if len(args) != i + 2:
+                print('Expected exactly one file name after >', file=sys.stderr)
+                return
+            try:
+                with open(args[i+1], 'w') as f:
+                    self.show_config(args[:i], f)
+            except OSError as e:
+                print('Failed to write '+args[i+1]+': '+e.strerror,
+                        file=sys.stderr)
+            return
+
+        if out == None:
+            out = sys.stdout
+
+        # Quotes a value for the command prompt
+        def quote(value):
+            return "'"+value.replace("'", "'\"'\"'")+"'"
+
+        # Everything is read with a constant number of queries, and the rows
+        # are written out as they are streamed from the server
+        (hosts, tags, assignments) = self._isidore.getDump()
 
         # Isidore Configuration
 
         ## Header
-        print("echo 'Setting global configuration'")
+        out.write("echo 'Setting global configuration'\n")
 
         ## Message of the Day
         motd = self._isidore.getMotd()
         if motd:
-            print("config set motd '"+motd.replace("'", "'\"'\"'")+"'")
+            out.write("config set motd "+quote(motd)+"\n")
 
         ## Name
         name = self._isidore.getName()
         if name:
-            print("config set name '"+name.replace("'", "'\"'\"'")+"'")
+            out.write("config set name "+quote(name)+"\n")
+
+        ## Materialized Inventory
+        if self._isidore.getMaterialized():
+            out.write("config set materialized on\n")
+
+        ## Variable Indexes
+        for path in self._isidore.getVarIndexes():
+            out.write("config set index '"+path+"' on\n")
 
         ## Blank line for sepeartion
-        print()
+        out.write("\n")
 
         # Create Hosts
-        print("echo 'Creating hosts'")
-        for host in hosts:
-            name = "'"+host.getHostname().replace("'", "'\"'\"'")+"'"
-            print("create host "+name)
-            print("host "+name+" set commissioned '"+\
-                    str(host.getCommissionDate())+"'")
-            print("host "+name+" set decommissioned '"+\
-                    str(host.getDecommissionDate()).lower()+"'")
-            if host.getDescription() == None:
-                print("host "+name+" set description none")
-            else:
-                print("host "+name+" set description '"+\
-                        str(host.getDescription()).replace("'", "'\"'\"'")+"'")
-            print("host "+name+" var set $ '"+\
-                    json.dumps(host.getVar()).replace("'", "'\"'\"'")+"'")
-        print()
+        out.write("echo 'Creating hosts'\n")
+        for (hostname, commissionDate, decommissionDate, description,
+                variables) in hosts:
+            prefix = "host "+quote(hostname)+" "
+            out.write("create host "+quote(hostname)+"\n"+
+                    prefix+"set commissioned '"+str(commissionDate)+"'\n"+
+                    prefix+"set decommissioned '"+
+                        str(decommissionDate).lower()+"'\n"+
+                    prefix+"set description "+
+                        ("none" if description == None
+                            else quote(str(description)))+"\n"+
+                    prefix+"var set $ "+
+                        quote(json.dumps(json.loads(variables)))+"\n")
+        out.write("\n")
 
         # Create Tags
-        print("echo 'Creating tags'")
-        for tag in tags:
-            name = "'"+tag.getName().replace("'", "'\"'\"'")+"'"
-            group = tag.getGroup()
-            description = tag.getDescription()
-            print("create tag %s" % (name))
-            print("tag %s set group '%s'" %
-                    (name,
-                    'none' if group == None
-                        else group.replace("'", "'\"'\"'")))
-            print("tag %s set description '%s'" % 
-                    (name,
-                    'none' if description == None
-                        else description.replace("'", "'\"'\"'")))
-            print("tag "+name+" var set $ '"+\
-                    json.dumps(tag.getVar()).replace("'", "'\"'\"'")+"'")
-        print()
+        out.write("echo 'Creating tags'\n")
+        for (name, group, description, variables) in tags:
+            prefix = "tag "+quote(name)+" "
+            out.write("create tag "+quote(name)+"\n"+
+                    prefix+"set group "+
+                        quote('none' if group == None else group)+"\n"+
+                    prefix+"set description "+
+                        quote('none' if description == None
+                            else description)+"\n"+
+                    prefix+"var set $ "+
+                        quote(json.dumps(json.loads(variables)))+"\n")
+        out.write("\n")
 
         # Assign Tags to Hosts
-        print("echo 'Assigning tags to hosts'")
-        for host in hosts:
-            hostname = "'"+host.getHostname().replace("'", "'\"'\"'")+"'"
-            for tag in host.getTags():
-                print("host "+hostname+" tag add '"+\
-                        str(tag.getName()).replace("'", "'\"'\"'")+"'")
-        print()
+        out.write("echo 'Assigning tags to hosts'\n")
+        for (hostname, name) in assignments:
+            out.write("host "+quote(hostname)+" tag add "+quote(name)+"\n")
+        out.write("\n")
 
     # > show graveyard
     def show_graveyard(self, args):
@@ -268,13 +493,83 @@ tags        print all tags in the database''')
 
     # > show hosts
     def show_hosts(self, args):
-        for host in self._isidore.getCommissionedHosts():
-            print(host.getHostname())
+        if len(args) == 2:
+            for host in self._isidore.getCommissionedHosts():
+                print(host.getHostname())
+
+        elif args[2] == '?':
+            print('''\
+?           print this help message
+where       print the hosts matching a tag expression or variable''')
+
+        # > show hosts where var <path> <operator> <value>
+        elif args[2] == 'where' and len(args) > 3 and args[3] == 'var' and \
+                (args[4:] == ['?'] or len(args) == 7 and args[5] in
+                [ '=', '!=', '<', '<=', '>', '>=', 'like', 'in' ]):
+            if args[4:] == ['?']:
+                print('''\
+<path> <operator> <value>
+                the variable to match. The operator is one of =, !=, <,
+                <=, >, >=, like (with * and ? wildcards), or in (an IP
+                address in a subnet). For example: ansible_host in
+                10.1.0.0/16''')
+                return
+
+            try:
+                hosts = self._isidore.getHostsByVar(args[4], args[5], args[6])
+            except ValueError as e:
+                print(str(e)+'.', file=sys.stderr)
+                return
+            for host in hosts:
+                print(host.getHostname())
+
+        # > show hosts where <expression>
+        elif args[2] == 'where':
+            if len(args) == 3 or args[3:] == ['?']:
+                print('''\
+<expression>    the tags to match, combined with and, or, not, and
+                parentheses. For example: server and (newark or trenton)
+                and not virtual
+var <path> <operator> <value>
+                the variable to match. Enter var ? for details.''')
+                return
+
+            try:
+                hostnames = self._isidore.getHostSelector().select(
+                        ' '.join(args[3:]))
+            except ValueError as e:
+                print(str(e)+'.', file=sys.stderr)
+                return
+            for hostname in hostnames:
+                print(hostname)
+
+        else:
+            print('Invalid argument '+args[2]+'. Enter ? for help.', file=sys.stderr)
 
     # > show inventory
-    def show_inventory(self, args):
+    # @param out        The file object to write the inventory to, or None to
+    #                   print it to stdout.
+    def show_inventory(self, args, out=None):
+        # > show inventory [<format>] > <file>
+        if '>' in args[2:]:
+            i = args.index('>', 2)
+            if len(args) != i + 2:
+                print('Expected exactly one file name after >', file=sys.stderr)
+                return
+            try:
+                with open(args[i+1], 'w') as f:
+                    self.show_inventory(args[:i], f)
+            except OSError as e:
+                print('Failed to write '+args[i+1]+': '+e.strerror,
+                        file=sys.stderr)
+            return
+
+        if out == None:
+            out = sys.stdout
+
         if len(args) == 2:
-            print(self._isidore.getInventoryIni())
+            self._isidore.writeInventoryIni(out)
+            print(file=out)
 
         elif args[2] == '?':
             print('''\
@@ -282,16 +577,21 @@ tags        print all tags in the database''')
 human       print the inventory in a human friendly format
 ini         print the inventory in INI format
 json        print the inventory in JSON format
-yaml        print the inventory in YAML format''')
+yaml        print the inventory in YAML format
+> <file>    write the inventory to a file instead of printing it''')
 
         elif args[2] == 'human':
-            print(yaml.dump(self._isidore.getInventory(), default_flow_style=False))
+            print(yaml.dump(self._isidore.getInventory(), default_flow_style=False),
+                    file=out)
         elif args[2] == 'ini':
-            print(self._isidore.getInventoryIni())
+            self._isidore.writeInventoryIni(out)
+            print(file=out)
         elif args[2] == 'json':
-            print(self._isidore.getInventoryJson())
+            self._isidore.writeInventoryJson(out)
+            print(file=out)
         elif args[2] == 'yaml':
-            print(self._isidore.getInventoryYaml())
+            self._isidore.writeInventoryYaml(out)
+            print(file=out)
         else:
             print('Invalid format '+args[2]+'. Enter ? for help.', file=sys.stderr)
 
@@ -393,8 +693,11 @@ tags        describe all tags in the database''')
         elif args[1] == '?':
             print('''\
 ?           print this help message
+restore     load a dump made with show config in one transaction
 show        print various data about the Isidore installation
 set         modify the Isidore installation''')
+        elif args[1] == 'restore':
+            self.config_restore(args)
         elif args[1] == 'show':
             self.config_show(args)
         elif args[1] == 'set':
@@ -404,6 +707,20 @@ set         modify the Isidore installation''')
         else:
             print('Invalid argument '+args[1]+'. Enter ? for help.', file=sys.stderr)
 
+    # > config restore
+    def config_restore(self, args):
+        if len(args) == 2 or args[2] == '?':
+            print('''\
+<file>      the file containing the dump''')
+            return
+
+        try:
+            with open(args[2]) as f:
+                self.restore(f)
+        except OSError as e:
+            print('Failed to read '+args[2]+': '+e.strerror,
+                    file=sys.stderr)
+
     # > config set
     def config_set(self, args):
         if len(args) == 2:
@@ -411,8 +728,36 @@ set         modify the Isidore installation''')
         elif args[2] == '?':
             print('''\
 ?           print this help message
+index       index a host variable for show hosts where var
+materialized    precompute the inventory in the database
 motd        set the message of the day
 name        set the name of the isidore instance''')
+        elif args[2] == 'index':
+            if len(args) == 3:
+                print('''\
+<path>          the path of the host variable to index''')
+            elif len(args) == 4:
+                print('''\
+on              index the variable
+off             drop the index of the variable''')
+            elif args[4] in [ 'on', 'off' ]:
+                try:
+                    self._isidore.setVarIndex(args[3], args[4] == 'on')
+                except ValueError as e:
+                    print(str(e)+'.', file=sys.stderr)
+            else:
+                print('Invalid argument '+args[4]+'. Enter ? for help.', file=sys.stderr)
+        elif args[2] == 'materialized':
+            if len(args) == 3:
+                print('''\
+on              keep the inventory precomputed in the database
+off             build the inventory from scratch every time''')
+            elif args[3] == 'on':
+                self._isidore.setMaterialized(True)
+            elif args[3] == 'off':
+                self._isidore.setMaterialized(False)
+            else:
+                print('Invalid argument '+args[3]+'. Enter ? for help.', file=sys.stderr)
         elif args[2] == 'motd':
             if len(args) == 3:
                 print('''\
@@ -442,6 +787,9 @@ none            clear the instance name''')
             print('''\
 ?           print this help message
 connection  display information about SQL database connection
+generation  display the number of times the database has been modified
+indexes     display the indexed host variables
+materialized    display whether the inventory is precomputed in the database
 motd        display the message of the day
 name        display the name of the Isidore instance
 version     display Isidore version information''')
@@ -451,6 +799,13 @@ version     display Isidore version information''')
                 'host': self._isidore.getDatabaseHost(),
                 'database': self._isidore.getDatabaseName()
             }, default_flow_style=False))
+        elif args[2] == 'generation':
+            print(self._isidore.getGeneration())
+        elif args[2] == 'indexes':
+            for path in self._isidore.getVarIndexes():
+                print(path)
+        elif args[2] == 'materialized':
+            print('on' if self._isidore.getMaterialized() else 'off')
         elif args[2] == 'motd':
             print(self._isidore.getMotd())
         elif args[2] == 'name':
@@ -483,11 +838,30 @@ tag         create a new tag''')
         elif args[2] == '?':
             print('''\
 ?           print this help message
-<hostname>  the hostname for the new host to create''')
+<hostname>  the hostname for the new host to create. Several
+            hostnames can be given to create them all at once, and a
+            range such as web[001:250] creates a host for each number
+            in it.''')
+        elif len(args) > 3 or _hostRange.search(args[2]):
+            try:
+                hostnames = list()
+                for hostname in args[2:]:
+                    hostnames += self._expandHostRange(hostname)
+            except ValueError as e:
+                print(str(e)+'.', file=sys.stderr)
+                return
+
+            # Create them all at once, falling back to one at a time to
+            # report which ones failed
+            try:
+                self._isidore.createHosts(hostnames)
+            except _connector.IntegrityError as e:
+                for hostname in hostnames:
+                    self.create_host(args[:2] + [ hostname ])
         else:
             try:
                 self._isidore.createHost(args[2])
-            except mysql.connector.errors.IntegrityError as e:
+            except _connector.IntegrityError as e:
                 print('Host %s already exists' % args[2],
                         file=sys.stderr)
             except:
@@ -503,11 +877,20 @@ tag         create a new tag''')
         elif args[2] == '?':
             print('''\
 ?           print this help message
-<name>      the name of the new tag to create''')
+<name>      the name of the new tag to create. Several names can be
+            given to create them all at once.''')
+        elif len(args) > 3:
+            # Create them all at once, falling back to one at a time to
+            # report which ones failed
+            try:
+                self._isidore.createTags(args[2:])
+            except _connector.IntegrityError as e:
+                for name in args[2:]:
+                    self.create_tag(args[:2] + [ name ])
         else:
             try:
                 self._isidore.createTag(args[2])
-            except mysql.connector.errors.IntegrityError as e:
+            except _connector.IntegrityError as e:
                 print('Tag %s already exists' % args[2],
                         file=sys.stderr)
             except:
@@ -551,7 +934,7 @@ tag         delete a tag''')
         try:
             host.delete()
             print("Host "+args[2]+" has been deleted.")
-        except mysql.connector.Error as e:
+        except _connector.Error as e:
             if e.errno == 1451:
                 print("Cannot delete host "+host.getHostname()+": it still has tags assigned to it.", file=sys.stderr)
             else:
@@ -584,7 +967,7 @@ tag         delete a tag''')
         try:
             tag.delete()
             print("Tag "+args[2]+" has been deleted.")
-        except mysql.connector.Error as e:
+        except _connector.Error as e:
             if e.errno == 1451:
                 print("Cannot delete tag "+tag.getName()+": it still has hosts assigned to it.", file=sys.stderr)
             else:
@@ -609,6 +992,32 @@ tag         delete a tag''')
         else:
             print(' '.join(args[1:]))
 
+    # > export
+    def export(self, args):
+        if len(args) == 1:
+            self.subprompt(args, self.export)
+        elif args[1] == '?':
+            print('''\
+?           print this help message
+snapshot    write the inventory to a binary snapshot file''')
+        elif args[1] == 'snapshot':
+            self.export_snapshot(args)
+        else:
+            print('Invalid argument '+args[1]+'. Enter ? for help.', file=sys.stderr)
+
+    # > export snapshot
+    def export_snapshot(self, args):
+        if len(args) == 2 or args[2] == '?':
+            print('''\
+<file>      the file to write the snapshot to''')
+            return
+
+        try:
+            self._isidore.getInventorySnapshot().saveBinary(args[2])
+        except OSError as e:
+            print('Failed to write '+args[2]+': '+e.strerror,
+                    file=sys.stderr)
+
     # > host
     def host(self, args):
         # Handle arg #1 (host <ARG1>)
@@ -618,7 +1027,12 @@ tag         delete a tag''')
         elif args[1] == '?':
             print('''\
 ?           print this help message
-<hostname>  the name of the host to edit''')
+<hostname>  the name of the host to edit. A pattern with * and ?
+            wildcards or ranges such as web[001:250] selects several
+            hosts at once.''')
+            return
+        elif _hostRange.search(args[1]) or '*' in args[1] or '?' in args[1]:
+            self.host_group(args)
             return
         host = self._isidore.getHost(args[1])
         if host == None:
@@ -649,6 +1063,38 @@ var         display and modify this host's variables''')
         else:
             print('Invalid command '+args[2]+'. Enter ? for help.', file=sys.stderr)
 
+    # > host <pattern>
+    def host_group(self, args):
+        # The hosts are looked up once and handed to the command, so the
+        # pattern isn't matched against the database a second time
+        try:
+            group = self._getHost(args[1])
+        except ValueError as e:
+            print(str(e)+'.', file=sys.stderr)
+            return
+        if group.getHosts() == []:
+            print('No hosts match '+args[1]+'!', file=sys.stderr)
+            return
+
+        # Only the changes that can be made to every host in one statement
+        # are available
+        if len(args) == 2 or len(args) == 3 and args[2] in [ 'set', 'tag', 'var' ]:
+            self.subprompt(args, self.host)
+        elif args[2] == '?' or args[3:] == [ '?' ]:
+            print('''\
+?           print this help message
+set decommissioned  set the date the hosts were decommissioned
+tag add     add tags to the hosts
+var set     set a variable on the hosts''')
+        elif args[2:4] == [ 'set', 'decommissioned' ]:
+            self.host_set_decommissioned(args, group)
+        elif args[2:4] == [ 'tag', 'add' ]:
+            self.host_tag_add(args, group)
+        elif args[2:4] == [ 'var', 'set' ]:
+            self.host_var_set(args, group)
+        else:
+            print('Invalid command '+' '.join(args[2:4])+' for several hosts. Enter ? for help.', file=sys.stderr)
+
     # > host <hostname> describe
     def host_describe(self, args):
         host = self._isidore.getHost(args[1])
@@ -678,6 +1124,7 @@ all         print all the information about the host
 commissioned    print the date the host was commissioned
 description     print the host's description
 decommissioned  print the date the host was decommissioned
+effective-vars  print the variables the host ends up with in Ansible
 tags        print the tags currently assigned to this host''')
         elif args[3] == 'all':
             print(yaml.dump(host.getDetails(), default_flow_style=False))
@@ -687,6 +1134,8 @@ tags        print the tags currently assigned to this host''')
             print(host.getDescription())
         elif args[3] == 'decommissioned':
             print(host.getDecommissionDate())
+        elif args[3] == 'effective-vars':
+            print(yaml.dump(host.getEffectiveVars(), default_flow_style=False))
         elif args[3] == 'tags':
             for tag in host.getTags():
                 print(tag.getName())
@@ -736,8 +1185,9 @@ now         use the current date''')
                 print("Failed to set commission date")
 
     # > host <hostname> set decommissioned
-    def host_set_decommissioned(self, args):
-        host = self._isidore.getHost(args[1])
+    def host_set_decommissioned(self, args, host=None):
+        if host == None:
+            host = self._getHost(args[1])
         if len(args) == 4:
             self.subprompt(args, self.host)
         elif args[4] == '?':
@@ -848,13 +1298,17 @@ $           print all variables
         elif args[5] == '?':
             print('''\
 ?           print this help message
-<json>      the JSON value to append to the list''')
+<json>      the JSON value to append to the list. Several values can be
+            given to append them all at once.''')
 
         else:
             try:
-                host.appendVar(args[4], json.loads(args[5]))
+                values = list()
+                for value in args[5:]:
+                    values.append(json.loads(value))
+                host.appendVar(args[4], *values)
             except json.decoder.JSONDecodeError:
-                print(args[5] + '''
+                print(value + '''
 ^-- this is not valid JSON
 
 Strings must be double quoted. It will be necessary to either nest double
@@ -872,8 +1326,9 @@ or
 'Failed to append to list variable. Is %s a valid list path?' % args[4])
 
     # > host <hostname> var set
-    def host_var_set(self, args):
-        host = self._isidore.getHost(args[1])
+    def host_var_set(self, args, host=None):
+        if host == None:
+            host = self._getHost(args[1])
         if len(args) == 4:
             self.subprompt(args, self.host_var_set)
         elif args[4] == '?':
@@ -924,15 +1379,36 @@ or
                 print("Failed to unset variable %s" % args[4])
 
     # > host <hostname> tag add
-    def host_tag_add(self, args):
-        host = self._isidore.getHost(args[1])
+    def host_tag_add(self, args, host=None):
+        if host == None:
+            host = self._getHost(args[1])
         if len(args) == 4:
             self.subprompt(args, self.host)
             return
         elif args[4] == '?':
             print('''\
 ?           print this help message
-<tag>       name of the tag to add''')
+<tag>       name of the tag to add. Several tags can be given to add
+            them all at once.''')
+            return
+
+        # > host <hostname> tag add <tag> <tag> ...
+        if len(args) > 5:
+            tags = list()
+            for name in args[4:]:
+                tag = self._isidore.getTag(name)
+                if tag == None:
+                    print("Tag "+name+" does not exist")
+                else:
+                    tags.append(tag)
+
+            # Add them all at once, falling back to one at a time to report
+            # which ones failed
+            try:
+                host.addTags(tags)
+            except _connector.IntegrityError as e:
+                for tag in tags:
+                    self.host_tag_add(args[:4] + [ tag.getName() ], host)
             return
 
         tag = self._isidore.getTag(args[4])
@@ -941,7 +1417,7 @@ or
             return
         try:
             host.addTag(tag)
-        except mysql.connector.Error as e:
+        except _connector.Error as e:
             if e.errno == 1062:
                 print(host.getHostname()+" already has tag "+args[4], file=sys.stderr)
         except:
@@ -1015,7 +1491,7 @@ Enter ? as any argument help.''', file=sys.stderr)
 
         try:
             host.setHostname(args[3])
-        except mysql.connector.Error as e:
+        except _connector.Error as e:
             if e.errno == 1062:
                 print('Host '+args[3]+' already exists.', file=sys.stderr)
             else:
@@ -1057,7 +1533,7 @@ Enter ? as any argument help.''', file=sys.stderr)
 
         try:
             tag.setName(args[3])
-        except mysql.connector.Error as e:
+        except _connector.Error as e:
             if e.errno == 1062:
                 print('Tag '+args[3]+' already exists.', file=sys.stderr)
             else:
@@ -1152,7 +1628,27 @@ remove      remove hosts from this tag''')
         elif args[4] == '?':
             print('''\
 ?           print this help message
-<host>      name of the host to add''')
+<host>      name of the host to add. Several hosts can be given to
+            add them all at once.''')
+            return
+
+        # > tag <tagname> host add <host> <host> ...
+        if len(args) > 5:
+            hosts = list()
+            for hostname in args[4:]:
+                host = self._isidore.getHost(hostname)
+                if host == None:
+                    print("Host "+hostname+" does not exist")
+                else:
+                    hosts.append(host)
+
+            # Add them all at once, falling back to one at a time to report
+            # which ones failed
+            try:
+                tag.addHosts(hosts)
+            except _connector.IntegrityError as e:
+                for host in hosts:
+                    self.tag_host_add(args[:4] + [ host.getHostname() ])
             return
 
         host = self._isidore.getHost(args[4])
@@ -1161,7 +1657,7 @@ remove      remove hosts from this tag''')
             return
         try:
             host.addTag(tag)
-        except mysql.connector.Error as e:
+        except _connector.Error as e:
             if e.errno == 1062:
                 print(host.getHostname()+" already has tag "+args[1], file=sys.stderr)
         except:
@@ -1306,13 +1802,17 @@ $           print all variables
         elif args[5] == '?':
             print('''\
 ?           print this help message
-<json>      the JSON value to append to the list''')
+<json>      the JSON value to append to the list. Several values can be
+            given to append them all at once.''')
 
         else:
             try:
-                tag.appendVar(args[4], json.loads(args[5]))
+                values = list()
+                for value in args[5:]:
+                    values.append(json.loads(value))
+                tag.appendVar(args[4], *values)
             except json.decoder.JSONDecodeError:
-                print(args[5] + '''
+                print(value + '''
 ^-- this is not valid JSON
 
 Strings must be double quoted. It will be necessary to either nest double
@@ -1387,3 +1887,39 @@ or
             print('libIsidore version: '+self._isidore.getVersion())
             print('Isidore database version: '+self._isidore.getDatabaseVersion())
 
+    # Expands the ranges in a hostname into the hostnames they stand for. A
+    # range is written [<start>:<end>] or [<start>:<end>:<step>], includes both
+    # ends, and is either numbers or letters. Numbers are padded with zeros to
+    # the width of <start>, so web[01:03] stands for web01, web02, and web03.
+    # As in Ansible, <end> can't come before <start>.
+    # @param hostname   The hostname with ranges
+    # @return           A list of the hostnames
+    # @throws ValueError    If a range is invalid
+    def _expandHostRange(self, hostname):
+        parts = _hostRange.split(hostname)
+        choices = [ [ parts[0] ] ]
+        for i in range(1, len(parts), 4):
+            (start, end, step) = parts[i:i+3]
+            step = int(step) if step != None else 1
+            if start.isdigit() != end.isdigit() or step == 0 or \
+                    (int(start) > int(end) if start.isdigit() else start > end):
+                raise ValueError('Invalid range ['+start+':'+end+']')
+            elif start.isdigit():
+                choices.append( [ str(n).zfill(len(start))
+                        for n in range(int(start), int(end) + 1, step) ] )
+            else:
+                choices.append( [ chr(n)
+                        for n in range(ord(start), ord(end) + 1, step) ] )
+            choices.append( [ parts[i+3] ] )
+
+        return [ ''.join(names) for names in itertools.product(*choices) ]
+
+    # Gets the host a command applies to
+    # @param hostname   The hostname, or a pattern with wildcards or ranges
+    #                   that selects several hosts
+    # @return           The Host object, a HostGroup object if the hostname
+    #                   is a pattern, or None if the host does not exist
+    def _getHost(self, hostname):
+        if _hostRange.search(hostname) or '*' in hostname or '?' in hostname:
+            return self._isidore.getHostGroup(self._expandHostRange(hostname))
+        return self._isidore.getHost(hostname)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# Copyright © 2023 Scott Court
+# 
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the “Software”), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+# of the Software, and to permit persons to whom the Software is furnished to do
+# so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED “AS IS”, WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import contextlib
+import os
+import socketserver
+import sys
+import threading
+import urllib.parse
+import http.server
+
+from isidore.libIsidore import *
+from isidore.libIsidore import _LazyModule
+
+_connector = _LazyModule('mysql.connector')
+
+# Serves the inventory over HTTP from an InventorySnapshot kept in memory. The
+# snapshot is only reloaded when the generation of the database changes, and
+# every response carries the generation as its ETag so that clients can
+# revalidate with If-None-Match and get a 304 when nothing has changed.
+class IsidoreServer:
+
+    _isidore = None
+    _lock = None
+    _loadLock = None
+    _dbLock = None
+    _generation = None
+    _snapshot = None
+    _rendered = None
+
+    # The inventory formats that can be requested and how to render them
+    _formats = {
+        '/inventory.json': ('application/json',
+            lambda snapshot: snapshot.getInventoryJson() + '\n'),
+        '/inventory.yaml': ('application/yaml',
+            lambda snapshot: snapshot.getInventoryYaml()),
+        '/inventory.ini': ('text/plain',
+            lambda snapshot: snapshot.getInventoryIni())
+    }
+
+    # Creates a new Isidore inventory server. If the Isidore instance has a
+    # connection pool, each request reads the generation over its own pooled
+    # connection, so requests are not held up behind each other. Otherwise
+    # they take turns on the single connection.
+    # @param isidore    The underlying Isidore instance to serve the inventory
+    #                   from
+    def __init__(self, isidore):
+        self._isidore = isidore
+        self._lock = threading.Lock()
+        self._loadLock = threading.Lock()
+        if isidore.getPoolSize() == None:
+            self._dbLock = threading.Lock()
+        else:
+            self._dbLock = contextlib.nullcontext()
+        self._rendered = dict()
+
+    # Gets the current generation and snapshot, reloading the snapshot if the
+    # database has changed since it was loaded. The lock is only held while
+    # the shared snapshot is read or replaced. Only one request loads a new
+    # snapshot at a time, and the others that need it wait for it.
+    # @return       A (generation, snapshot, rendered) tuple, where rendered is
+    #               the dictionary of the formats rendered from the snapshot
+    def _refresh(self):
+        # Start a new transaction so the latest generation is seen, and so the
+        # snapshot is loaded from the same view of the database as the
+        # generation.
+        try:
+            self._isidore.newTransaction()
+        except _connector.Error:
+            # The connection may have been closed by the server after being
+            # idle for too long
+            self._isidore.reconnect(attempts=3, delay=1)
+            self._isidore.newTransaction()
+
+        generation = self._isidore.getGeneration()
+        with self._lock:
+            if generation == self._generation:
+                return (self._generation, self._snapshot, self._rendered)
+
+        with self._loadLock:
+            # Another request may have loaded it while this one waited
+            with self._lock:
+                if self._generation != None and self._generation >= generation:
+                    return (self._generation, self._snapshot, self._rendered)
+
+            snapshot = self._isidore.getInventorySnapshot()
+            with self._lock:
+                self._snapshot = snapshot
+                self._generation = generation
+                self._rendered = dict()
+                return (self._generation, self._snapshot, self._rendered)
+
+    # Gets the response for a request path
+    # @param path       The path of the request
+    # @return           A (status, content type, body, generation) tuple. The
+    #                   body is None if the path does not exist.
+    def get(self, path):
+        with self._dbLock, self._isidore.session():
+            (generation, snapshot, rendered) = self._refresh()
+
+        # Whole inventory. Each format is rendered about once per generation.
+        # Two requests that come in at the same time may both render it, but
+        # they render the same thing.
+        if path in self._formats:
+            (contentType, render) = self._formats[path]
+            if path not in rendered:
+                rendered[path] = render(snapshot).encode()
+            return (200, contentType, rendered[path], generation)
+
+        # Single host
+        if path.startswith('/host/'):
+            hostname = urllib.parse.unquote(path[len('/host/'):])
+            hostvars = snapshot.getHostVars(hostname)
+            if hostvars != None:
+                return (200, 'application/json',
+                        (json.dumps(hostvars) + '\n').encode(), generation)
+
+        return (404, 'text/plain', None, generation)
+
+    # Creates the HTTP server. It is not started until serve_forever() is
+    # called on it.
+    # @param address    A (host, port) tuple to listen on, or the path of a
+    #                   unix socket to listen on.
+    # @return           The socketserver.BaseServer
+    def createHttpServer(self, address):
+        server = self
+
+        class Handler(_IsidoreRequestHandler):
+            isidore_server = server
+
+        if isinstance(address, str):
+            # Remove the socket left behind by a previous run
+            if os.path.exists(address):
+                os.unlink(address)
+            return _UnixHTTPServer(address, Handler)
+        return http.server.ThreadingHTTPServer(address, Handler)
+
+# Handles a single HTTP request for IsidoreServer
+class _IsidoreRequestHandler(http.server.BaseHTTPRequestHandler):
+
+    isidore_server = None
+    server_version = 'isidore-serve'
+
+    # Requests over a unix socket have no client address
+    def address_string(self):
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return 'unix'
+
+    def do_GET(self):
+        self._respond(True)
+
+    def do_HEAD(self):
+        self._respond(False)
+
+    def _respond(self, sendBody):
+        path = urllib.parse.urlsplit(self.path).path
+        try:
+            (status, contentType, body, generation) = \
+                    self.isidore_server.get(path)
+        except Exception as e:
+            self.send_error(500, explain=str(e))
+            return
+
+        if body == None:
+            self.send_error(404)
+            return
+
+        # Clients that already have this generation get a 304 without a body
+        etag = '"%d"' % generation
+        if self._notModified(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        self.send_header('Content-Type', contentType + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if sendBody:
+            self.wfile.write(body)
+
+    # Checks whether the If-None-Match header of the request matches an ETag.
+    # The header is a comma separated list of ETags or *. ETags are compared
+    # weakly, as RFC 7232 requires for If-None-Match, so a W/ prefix is
+    # ignored.
+    # @param etag       The current ETag
+    # @return           True if the client already has the current version
+    def _notModified(self, etag):
+        for tag in self.headers.get('If-None-Match', '').split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == '*' or tag == etag:
+                return True
+        return False
+
+# An HTTP server listening on a unix socket that handles each request in its
+# own thread
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+
+    daemon_threads = True
+
+    # The HTTP server expects a host and a port
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
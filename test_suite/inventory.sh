@@ -0,0 +1,97 @@
+#!/bin/sh
+
+cd "$(dirname $0)"
+PYTHON=${PYTHON:-python3}
+CONFIG=
+
+args=`getopt F:p: $*`
+if [ $? -ne 0 ]; then
+	echo "Usage: inventory.sh [-Fp]"
+	exit 1
+fi
+set -- $args
+
+while :; do
+	case "$1" in
+		-F)
+			CONFIG="$2"
+			shift; shift
+			;;
+		-p)
+			PYTHON="$2"
+			shift; shift
+			;;
+		--)
+			shift
+			break
+			;;
+	esac
+done
+
+# Create hosts whose names sort differently by code point than by the
+# collation of the database, build the YAML inventory both from the database
+# and from a snapshot, and check that each matches the inventory as yaml.dump()
+# writes it
+CONFIG="$CONFIG" $PYTHON - <<'END'
+import io
+import os
+import sys
+import yaml
+from isidore.libIsidore import Isidore
+
+isidore = Isidore.fromConfigFile(os.environ['CONFIG'] or None)
+hostnames = [ 'Web01', 'api01', 'web_1' ]
+isidore.createHosts(hostnames)
+isidore.createTag('Mixed')
+tag = isidore.getTag('Mixed')
+hosts = [ isidore.getHost(name) for name in hostnames ]
+for host in hosts:
+    host.addTag(tag)
+
+try:
+    tag_all = isidore.getTag('all')
+    inv = {
+            'all': {
+                'hosts': dict(),
+                'children': dict(),
+                'vars': dict() if tag_all == None
+                    else tag_all.getDetails()['all']['vars']
+            }
+    }
+    for host in isidore.getCommissionedHosts():
+        name = host.getHostname()
+        inv['all']['hosts'][name] = host.getDetails()[name]['vars']
+    for t in isidore.getTags(True):
+        name = t.getName()
+        if name == 'all':
+            continue
+        details = t.getDetails()
+        inv['all']['children'][name] = {
+                'hosts': dict.fromkeys(details[name]['hosts'], dict()),
+                'vars': details[name]['vars']
+        }
+    dumper = yaml.dumper.SafeDumper
+    dumper.ignore_aliases = lambda self, data: True
+    expected = yaml.dump(inv, default_flow_style=False, Dumper=dumper)
+
+    out = io.StringIO()
+    isidore.writeInventoryYaml(out)
+    outputs = [
+        ('database', out.getvalue()),
+        ('snapshot', isidore.getInventorySnapshot().getInventoryYaml()),
+    ]
+finally:
+    for host in hosts:
+        host.removeTag(tag)
+        host.delete()
+    tag.delete()
+
+failed = False
+for (name, output) in outputs:
+    if output == expected:
+        print('[PASS] ' + name)
+    else:
+        print('[FAIL] ' + name)
+        failed = True
+sys.exit(1 if failed else 0)
+END
@@ -0,0 +1,77 @@
+#!/bin/sh
+
+cd "$(dirname $0)"
+PYTHON=${PYTHON:-python3}
+RUNS=${RUNS:-1000}
+CONFIG=
+
+args=`getopt F:n:p: $*`
+if [ $? -ne 0 ]; then
+	echo "Usage: lookups.sh [-Fnp]"
+	exit 1
+fi
+set -- $args
+
+while :; do
+	case "$1" in
+		-F)
+			CONFIG="$2"
+			shift; shift
+			;;
+		-n)
+			RUNS="$2"
+			shift; shift
+			;;
+		-p)
+			PYTHON="$2"
+			shift; shift
+			;;
+		--)
+			shift
+			break
+			;;
+	esac
+done
+
+# Time the lookups the library runs most often with each combination of the
+# MySQL connector implementation and prepared statements
+CONFIG="$CONFIG" RUNS="$RUNS" $PYTHON - <<'END'
+import os
+import time
+import mysql.connector
+from isidore.libIsidore import Isidore
+
+runs = int(os.environ['RUNS'])
+base = Isidore.fromConfigFile(os.environ['CONFIG'] or None)
+args = base._connectArgs
+host = base.getCommissionedHosts()[0]
+tag = host.getTags()[0]
+
+modes = [ ('pure', True) ]
+if mysql.connector.HAVE_CEXT:
+    modes.insert(0, ('cext', False))
+
+print('%-6s %-9s %-16s %10s' % ('conn', 'prepared', 'lookup', 'us/call'))
+for (name, usePure) in modes:
+    for prepared in [ False, True ]:
+        isidore = Isidore(args['user'], args['password'], args['host'],
+                args['database'], use_pure=usePure, prepared=prepared)
+        h = isidore.getHost(host.getHostname())
+        t = isidore.getTag(tag.getName())
+        lookups = [
+            ('getHost', lambda: isidore.getHost(host.getHostname())),
+            ('Host.getVar', lambda: h.getVar()),
+            ('Host.getTags', lambda: h.getTags()),
+            ('getTag', lambda: isidore.getTag(tag.getName())),
+            ('Tag.getVar', lambda: t.getVar()),
+            ('Tag.getHosts', lambda: t.getHosts()),
+        ]
+        for (lookup, func) in lookups:
+            func()
+            start = time.perf_counter()
+            for i in range(runs):
+                func()
+            elapsed = time.perf_counter() - start
+            print('%-6s %-9s %-16s %10.1f' % (name, 'yes' if prepared else 'no',
+                    lookup, elapsed / runs * 1000000))
+END
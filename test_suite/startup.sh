@@ -0,0 +1,69 @@
+#!/bin/sh
+
+cd "$(dirname $0)"
+ISIDORE=${ISIDORE:-isidore}
+PYTHON=${PYTHON:-python3}
+RUNS=${RUNS:-20}
+
+args=`getopt i:n:p: $*`
+if [ $? -ne 0 ]; then
+	echo "Usage: startup.sh [-inp]"
+	exit 1
+fi
+set -- $args
+
+while :; do
+	case "$1" in
+		-i)
+			ISIDORE="$2"
+			shift; shift
+			;;
+		-n)
+			RUNS="$2"
+			shift; shift
+			;;
+		-p)
+			PYTHON="$2"
+			shift; shift
+			;;
+		--)
+			shift
+			break
+			;;
+	esac
+done
+
+# Import the command prompt library and check that none of the modules that
+# are only needed once a command runs have been loaded
+$PYTHON - <<'END'
+import sys
+import time
+
+start = time.perf_counter()
+import isidore.libIsidoreCmdline
+elapsed = time.perf_counter() - start
+print('Import time: %.1f ms' % (elapsed * 1000))
+
+loaded = [ name for name in [ 'mysql.connector', 'yaml', 'readline' ]
+        if name in sys.modules ]
+if loaded:
+    print('Loaded at import: ' + ', '.join(loaded))
+    sys.exit(1)
+END
+if [ $? -ne 0 ]; then
+	echo "[FAIL] lazy imports"
+	exit 1
+fi
+echo "[PASS] lazy imports"
+
+# Time a command that does not need the database and one that does
+for command in "echo hello" "version"; do
+	start=$(date +%s%N)
+	i=0
+	while [ $i -lt $RUNS ]; do
+		eval $ISIDORE $command > /dev/null 2>&1
+		i=$(expr $i + 1)
+	done
+	end=$(date +%s%N)
+	echo "$command: $(expr \( $end - $start \) / $RUNS / 1000000) ms per run"
+done